@@ -0,0 +1,117 @@
+"""
+Static asset module for the dashboard application.
+Loads the static folder into memory at startup, names every file after a
+hash of its content, and precompresses it with gzip and, when the brotli
+package is installed, brotli.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+_brotli = None
+
+
+def brotli_compress(data):
+    """Compress with brotli, or get None when the brotli package is not installed
+
+    brotli is only imported here, the first time an asset is compressed, so
+    importing this module stays cheap for processes that serve no assets.
+    """
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    if not _brotli:
+        return None
+    return _brotli.compress(data, quality=11)
+
+
+# Encodings in order of preference, with their compressors
+ENCODINGS = [
+    ('br', brotli_compress),
+    ('gzip', lambda data: gzip.compress(data, compresslevel=9, mtime=0))
+]
+
+
+class Asset:
+    """One static file with its precompressed encodings"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.etag = self.digest
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.encodings = {None: data}
+
+        if len(data) >= MIN_COMPRESS_SIZE:
+            for name, compress in ENCODINGS:
+                compressed = compress(data)
+                # Keep only encodings that are available and actually save bytes
+                if compressed is not None and len(compressed) < len(data):
+                    self.encodings[name] = compressed
+
+    @property
+    def hashed_path(self):
+        base, extension = os.path.splitext(self.path)
+        return f'{base}.{self.digest}{extension}'
+
+    def select(self, accept_encoding):
+        """Get the best encoding the client accepts and its bytes"""
+        accepted = set()
+        for part in (accept_encoding or '').split(','):
+            name, _, params = part.partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(name.strip())
+        for name, _ in ENCODINGS:
+            if name in accepted and name in self.encodings:
+                return name, self.encodings[name]
+        return None, self.encodings[None]
+
+
+class AssetStore:
+    """All static files, looked up by their plain or fingerprinted path"""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.assets = {}
+        self.hashed = {}
+        self.load()
+
+    def load(self):
+        """Read and compress every file below the static folder"""
+        assets = {}
+        for root, _, files in os.walk(self.static_dir):
+            for fname in files:
+                full_path = os.path.join(root, fname)
+                path = os.path.relpath(full_path, self.static_dir).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    assets[path] = Asset(path, f.read())
+
+        self.assets = assets
+        self.hashed = {asset.hashed_path: asset for asset in assets.values()}
+
+    def url(self, path):
+        """Get the fingerprinted URL of a static file"""
+        asset = self.assets.get(path)
+        return '/static/' + (asset.hashed_path if asset else path)
+
+    def lookup(self, path):
+        """Find an asset, returns it and whether it was asked for by fingerprinted path"""
+        if path in self.hashed:
+            return self.hashed[path], True
+        return self.assets.get(path), False
+
+    def summary(self):
+        """Get the number of files, their size and their smallest compressed size"""
+        plain = sum(len(asset.encodings[None]) for asset in self.assets.values())
+        smallest = sum(min(len(data) for data in asset.encodings.values()) for asset in self.assets.values())
+        return len(self.assets), plain, smallest
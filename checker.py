@@ -0,0 +1,847 @@
+"""
+Health check module for the dashboard application.
+Probes hosts in parallel with a per-host deadline and an overall sweep deadline,
+and re-checks every host on its own schedule in the background.
+
+Run as a standalone service with:
+    python checker.py <config_file>
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import socket
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from metrics import Counter, Gauge, Histogram, PROBE_BUCKETS
+
+
+# Probe types a host can use, with their labels
+PROBE_TYPES = [
+    ('http', 'HTTP(S) request'),
+    ('tcp-connect', 'TCP connect'),
+    ('tls-handshake', 'TLS handshake')
+]
+
+# Sweep results of hosts that were not checked before the sweep deadline, which
+# must not be saved: 'timeout' for probes still running, 'skipped' for probes
+# that never started
+UNCHECKED_STATUSES = ('timeout', 'skipped')
+
+# Ports used when a URL does not name one
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'tcp-connect': 80, 'tls-handshake': 443}
+
+PROBE_SECONDS = Histogram('dashboard_probe_seconds', 'Duration of host probes',
+                          ['probe_type', 'status'], buckets=PROBE_BUCKETS)
+PROBES_IN_FLIGHT = Gauge('dashboard_probes_in_flight', 'Host probes currently running')
+SWEEPS = Counter('dashboard_sweeps_total', 'Check All sweeps started')
+SWEEP_HOSTS = Counter('dashboard_sweep_hosts_total', 'Hosts reported by Check All sweeps, '
+                      'outcome "timeout" or "skipped" for hosts cut off by the sweep deadline', ['outcome'])
+SWEEP_SECONDS = Histogram('dashboard_sweep_seconds', 'Wall time of Check All sweeps', buckets=PROBE_BUCKETS)
+
+
+# Timings of the current thread's probe: the connect time of the last new
+# connection, and when the response headers of the last request arrived
+_probe_timing = threading.local()
+
+
+_adapter_class = None
+
+# Shared by all TLS probes, which don't verify certificates
+_tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+_tls_context.check_hostname = False
+_tls_context.verify_mode = ssl.CERT_NONE
+
+
+def timed_adapter_class():
+    """Get the HTTPAdapter subclass that records how long each new TCP connect takes
+
+    requests and urllib3 are only imported here, the first time a session is
+    created, so processes that never probe over HTTP start without them.
+    """
+    global _adapter_class
+    if _adapter_class is not None:
+        return _adapter_class
+
+    import requests.adapters
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _TimedHTTPConnection(HTTPConnection):
+        def _new_conn(self):
+            start = time.monotonic()
+            sock = super()._new_conn()
+            _probe_timing.connect = time.monotonic() - start
+            return sock
+
+    class _TimedHTTPSConnection(HTTPSConnection):
+        def _new_conn(self):
+            start = time.monotonic()
+            sock = super()._new_conn()
+            _probe_timing.connect = time.monotonic() - start
+            return sock
+
+    class _TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _TimedHTTPConnection
+
+    class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _TimedHTTPSConnection
+
+    class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _TimedHTTPConnectionPool,
+                'https': _TimedHTTPSConnectionPool
+            }
+
+    _adapter_class = TimedHTTPAdapter
+    return _adapter_class
+
+
+class LatencyEstimator:
+    """Rolling latency percentiles from an exponentially decayed histogram
+
+    Samples fall into logarithmic buckets from 1 ms to about 2 minutes, each
+    bucket 25% wider than the previous one. Before a sample is added every
+    bucket is multiplied by `decay`, so old samples fade out and updates
+    never need the history. Percentiles are accurate to one bucket width.
+    """
+
+    RATIO = 1.25
+    BUCKETS = 54
+
+    def __init__(self, weights=None, decay=0.98):
+        self.weights = weights or {}
+        self.decay = decay
+
+    @classmethod
+    def load(cls, state, decay=0.98):
+        """Restore an estimator saved with dump(), or a new one without state"""
+        if not state:
+            return cls(decay=decay)
+        try:
+            return cls({int(index): weight for index, weight in json.loads(state).items()}, decay)
+        except (ValueError, AttributeError):
+            return cls(decay=decay)
+
+    def dump(self):
+        """Serialize the histogram to a compact JSON string"""
+        return json.dumps({str(index): round(weight, 4) for index, weight in self.weights.items()},
+                          separators=(',', ':'))
+
+    def add(self, latency_ms):
+        """Add a latency sample in milliseconds"""
+        index = 0
+        if latency_ms > 1:
+            index = min(self.BUCKETS - 1, int(math.log(latency_ms) / math.log(self.RATIO)) + 1)
+        weights = {}
+        for bucket, weight in self.weights.items():
+            weight *= self.decay
+            if weight >= 0.001:
+                weights[bucket] = weight
+        weights[index] = weights.get(index, 0) + 1
+        self.weights = weights
+
+    def percentile(self, fraction):
+        """Latency in milliseconds below which `fraction` of the samples fall"""
+        total = sum(self.weights.values())
+        if not total:
+            return None
+        target = total * fraction
+        seen = 0
+        for index in sorted(self.weights):
+            seen += self.weights[index]
+            if seen >= target:
+                return int(round(self.RATIO ** index))
+        return int(round(self.RATIO ** max(self.weights)))
+
+
+
+def candidate_urls(url, preferred_scheme=None):
+    """List the URLs to try for a host, in order
+
+    URLs without a scheme are tried with http:// and then https://, unless
+    `preferred_scheme` says which of the two worked last time.
+    """
+    clean_url = url.rstrip('/')
+    if clean_url.startswith(('http://', 'https://')):
+        return [clean_url]
+
+    schemes = ['http', 'https']
+    if preferred_scheme in schemes:
+        schemes.remove(preferred_scheme)
+        schemes.insert(0, preferred_scheme)
+    return [f'{scheme}://{clean_url}' for scheme in schemes]
+
+
+def url_hostname(url):
+    """Get the lowercase hostname of a URL, with or without a scheme"""
+    target = url.strip()
+    if '://' not in target:
+        target = '//' + target
+    return (urlsplit(target).hostname or '').lower()
+
+
+def create_session(pool_size=64):
+    """Create a keep-alive session shared by all probe threads
+
+    `pool_size` is the number of hosts whose connections are kept open
+    between checks. Cookies are ignored so probes stay independent.
+    """
+    import http.cookiejar
+    import requests
+
+    session = requests.Session()
+    adapter = timed_adapter_class()(pool_connections=pool_size, pool_maxsize=2)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def fetch_status(client, url, timeout, head_first=True, max_body_bytes=65536, deadline=None):
+    """Request a URL and return the response once its status is known
+
+    With `head_first` a HEAD request is sent, and a streamed GET when the
+    HEAD is refused, or when the connection is dropped on it, as some
+    embedded devices do, while time before `deadline` is left. GET bodies
+    are read up to `max_body_bytes`: a small body is drained so its
+    connection goes back to the pool, a larger one is abandoned and its
+    connection closed.
+    """
+    import requests
+
+    if head_first:
+        try:
+            response = client.head(url, timeout=timeout, allow_redirects=True)
+        except requests.ConnectionError as e:
+            # A host that doesn't answer at all won't answer a GET either
+            if isinstance(e, requests.Timeout):
+                raise
+            response = None
+        else:
+            _probe_timing.headers = time.monotonic()
+            response.close()
+            if response.status_code < 400:
+                return response
+        timeout = _remaining_timeout(timeout, deadline)
+        if timeout <= 0:
+            raise requests.ConnectionError(f'No time left for a GET of {url}')
+
+    response = client.get(url, timeout=timeout, stream=True)
+    _probe_timing.headers = time.monotonic()
+    try:
+        read = 0
+        if max_body_bytes > 0:
+            for chunk in response.iter_content(chunk_size=8192):
+                read += len(chunk)
+                if read >= max_body_bytes:
+                    break
+    finally:
+        response.close()
+    return response
+
+
+def probe_http(url, timeout, deadline=None, resolved_url=None, preferred_scheme=None,
+               session=None, head_first=True, max_body_bytes=65536):
+    """Check if a host answers over HTTP(S)
+
+    `resolved_url` is the final URL of the last successful probe; it is tried
+    first, and the regular candidates are tried if it no longer works. It is
+    ignored when a redirect led to another host, such as a login portal, whose
+    availability says nothing about the host itself.
+    `deadline` is an absolute time.monotonic() value; no attempt is started
+    after it and each request timeout is capped to the time that is left.
+    Requests go through `session` when given, otherwise through a session
+    that is closed after the probe.
+
+    Returns a dict with 'status', and for online hosts the 'scheme' that
+    answered, the 'resolved_url' reached after redirects, and the 'connect_ms'
+    (None when a kept-alive connection was reused) and 'ttfb_ms' timings of
+    the attempt that answered.
+    """
+    client = session or create_session(1)
+    if resolved_url and url_hostname(resolved_url) != url_hostname(url):
+        resolved_url = None
+    attempts = [(resolved_url, True)] if resolved_url else []
+    attempts += [(candidate, False) for candidate in candidate_urls(url, preferred_scheme)
+                 if candidate != resolved_url]
+
+    try:
+        for test_url, fallback_allowed in attempts:
+            request_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request_timeout = min(timeout, remaining)
+            _probe_timing.connect = None
+            start = time.monotonic()
+            try:
+                response = fetch_status(client, test_url, request_timeout, head_first, max_body_bytes, deadline)
+            except Exception:
+                continue
+
+            if response.status_code < 400:
+                connect = _probe_timing.connect
+                return {
+                    'status': 'online',
+                    'scheme': test_url.split('://', 1)[0],
+                    'resolved_url': response.url,
+                    'connect_ms': int(connect * 1000) if connect is not None else None,
+                    'ttfb_ms': int((_probe_timing.headers - start) * 1000)
+                }
+            if not fallback_allowed:
+                return {'status': 'offline'}
+        return {'status': 'offline'}
+    finally:
+        if session is None:
+            client.close()
+
+
+def parse_target(url, probe_type):
+    """Split a host URL into the hostname and port to connect to
+
+    Without a port in the URL, the scheme's service port is used, like 22 for
+    ssh://, and the probe type's default port only for URLs without a scheme.
+    Raises ValueError for a scheme whose port is unknown.
+    """
+    target = url.strip()
+    if '://' not in target:
+        target = '//' + target
+    parts = urlsplit(target)
+    port = parts.port or DEFAULT_PORTS.get(parts.scheme)
+    if not port and parts.scheme:
+        try:
+            port = socket.getservbyname(parts.scheme, 'tcp')
+        except OSError:
+            raise ValueError(f'No port given and none known for {parts.scheme}://') from None
+    return parts.hostname, port or DEFAULT_PORTS[probe_type]
+
+
+def _remaining_timeout(timeout, deadline):
+    if deadline is None:
+        return timeout
+    return min(timeout, max(0, deadline - time.monotonic()))
+
+
+def probe_tcp(url, timeout, deadline=None):
+    """Check if a host accepts a TCP connection
+
+    Returns a dict with 'status' and, for online hosts, 'connect_ms'.
+    """
+    try:
+        host, port = parse_target(url, 'tcp-connect')
+        request_timeout = _remaining_timeout(timeout, deadline)
+        if not host or request_timeout <= 0:
+            return {'status': 'offline'}
+        start = time.monotonic()
+        with socket.create_connection((host, port), timeout=request_timeout):
+            connect_ms = int((time.monotonic() - start) * 1000)
+    except (OSError, ValueError):
+        return {'status': 'offline'}
+    return {'status': 'online', 'connect_ms': connect_ms}
+
+
+def probe_tls(url, timeout, deadline=None):
+    """Check if a host completes a TLS handshake
+
+    Certificates are not verified: this checks that the service answers,
+    the same way a TCP probe does, one layer up.
+    Returns a dict with 'status' and, for online hosts, 'connect_ms' and the
+    time until the handshake completed as 'ttfb_ms'.
+    """
+    try:
+        host, port = parse_target(url, 'tls-handshake')
+        request_timeout = _remaining_timeout(timeout, deadline)
+        if not host or request_timeout <= 0:
+            return {'status': 'offline'}
+        start = time.monotonic()
+        with socket.create_connection((host, port), timeout=request_timeout) as sock:
+            connect_ms = int((time.monotonic() - start) * 1000)
+            with _tls_context.wrap_socket(sock, server_hostname=host):
+                handshake_ms = int((time.monotonic() - start) * 1000)
+    except (OSError, ValueError):
+        return {'status': 'offline'}
+    return {'status': 'online', 'connect_ms': connect_ms, 'ttfb_ms': handshake_ms}
+
+
+class HostChecker:
+    """Runs health checks for many hosts concurrently"""
+
+    def __init__(self, timeout, workers=16, host_deadline=None, sweep_deadline=None,
+                 keep_alive=True, pool_size=64, head_first=True, max_body_bytes=65536):
+        self.timeout = timeout
+        self.workers = max(1, int(workers))
+        self.host_deadline = host_deadline or None
+        self.sweep_deadline = sweep_deadline or None
+        self.keep_alive = keep_alive
+        self.pool_size = pool_size
+        self.head_first = head_first
+        self.max_body_bytes = max_body_bytes
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The shared keep-alive session, created on the first HTTP probe"""
+        if not self.keep_alive:
+            return None
+        with self._session_lock:
+            if self._session is None:
+                self._session = create_session(self.pool_size)
+            return self._session
+
+    def _result(self, host, status, latency_ms=None, probe=None):
+        now = datetime.now()
+        probe = probe or {}
+        return {
+            'id': host['id'],
+            'status': status,
+            'last_checked': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'checked_at': int(now.timestamp()),
+            'latency_ms': latency_ms,
+            'connect_ms': probe.get('connect_ms'),
+            'ttfb_ms': probe.get('ttfb_ms'),
+            'resolved_url': probe.get('resolved_url'),
+            'resolved_scheme': probe.get('scheme')
+        }
+
+    def _add_percentiles(self, host, result):
+        """Fold an online result's latency into the host's rolling percentiles"""
+        estimator = LatencyEstimator.load(host.get('latency_state'))
+        estimator.add(result['latency_ms'])
+        result['latency_state'] = estimator.dump()
+        result['latency_p50'] = estimator.percentile(0.50)
+        result['latency_p95'] = estimator.percentile(0.95)
+        result['latency_p99'] = estimator.percentile(0.99)
+
+    def check_host(self, host):
+        """Probe a single host and return its result
+
+        Online results carry the updated rolling latency percentiles of the
+        host; offline results leave them unchanged.
+        """
+        start = time.monotonic()
+        deadline = None
+        if self.host_deadline:
+            deadline = start + self.host_deadline
+        probe_type = host.get('probe_type') or 'http'
+        PROBES_IN_FLIGHT.inc()
+        try:
+            if probe_type == 'tcp-connect':
+                probe = probe_tcp(host['url'], self.timeout, deadline)
+            elif probe_type == 'tls-handshake':
+                probe = probe_tls(host['url'], self.timeout, deadline)
+            else:
+                probe = probe_http(host['url'], self.timeout, deadline,
+                                   resolved_url=host.get('resolved_url'),
+                                   preferred_scheme=host.get('resolved_scheme'),
+                                   session=self.session,
+                                   head_first=self.head_first,
+                                   max_body_bytes=self.max_body_bytes)
+        finally:
+            PROBES_IN_FLIGHT.dec()
+        elapsed = time.monotonic() - start
+        PROBE_SECONDS.observe(elapsed, probe_type, probe['status'])
+        latency_ms = int(elapsed * 1000)
+        result = self._result(host, probe['status'], latency_ms, probe)
+        if result['status'] == 'online':
+            self._add_percentiles(host, result)
+        return result
+
+    def iter_results(self, hosts):
+        """Probe hosts in parallel, yielding each result as soon as it completes
+
+        Hosts still running when the sweep deadline expires are reported as
+        'timeout', and hosts whose probe never started as 'skipped'. These
+        results only have an 'id' and a 'status', see UNCHECKED_STATUSES.
+        """
+        hosts = [host for host in hosts if host.get('url')]
+        if not hosts:
+            return
+
+        start = time.monotonic()
+        SWEEPS.inc()
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(hosts)),
+                                      thread_name_prefix='checker')
+        futures = {executor.submit(self.check_host, host): host for host in hosts}
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=self.sweep_deadline):
+                pending.discard(future)
+                result = future.result()
+                SWEEP_HOSTS.inc(result['status'])
+                yield result
+        except FuturesTimeoutError:
+            for future in list(pending):
+                pending.discard(future)
+                if future.cancel():
+                    result = {'id': futures[future]['id'], 'status': 'skipped'}
+                elif future.done():
+                    result = future.result()
+                else:
+                    result = {'id': futures[future]['id'], 'status': 'timeout'}
+                SWEEP_HOSTS.inc(result['status'])
+                yield result
+        finally:
+            SWEEP_SECONDS.observe(time.monotonic() - start)
+            # Don't wait for stragglers, they are bounded by the host deadline
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def check_hosts(self, hosts):
+        """Probe all hosts in parallel and return the list of results"""
+        return list(self.iter_results(hosts))
+
+
+# Lease that spaces history compactions `compact_interval` apart across processes
+COMPACT_LEASE = 'compaction'
+
+
+def compact_history_if_due(db, history, interval):
+    """Downsample the check history unless any process did so in the last `interval` seconds
+
+    The lease is taken under a new owner every time and never released, so
+    it only becomes free `interval` seconds after the last compaction and
+    works as a timer shared by the dashboard workers and the checker.
+    Returns whether the history was compacted.
+    """
+    if not interval or not db.acquire_lease(COMPACT_LEASE, f'{os.getpid()}:{random.getrandbits(32):08x}', interval):
+        return False
+    try:
+        removed = db.compact_history(**history)
+        if any(removed.values()):
+            print(f"Compacted check history: {removed['raw']} raw results, "
+                  f"{removed['hourly']} hourly and {removed['daily']} daily rollups removed")
+    except Exception as e:
+        print(f'Could not compact check history: {e}')
+    return True
+
+
+def history_settings(config):
+    """Get the retention settings passed to DashboardDatabase.compact_history()"""
+    return {
+        'raw_days': config['history']['raw_days'],
+        'hourly_days': config['history']['hourly_days'],
+        'daily_days': config['history']['daily_days']
+    }
+
+
+class BackgroundChecker:
+    """Re-probes each host on its own interval from a background thread
+
+    Hosts use their `check_interval` column when set, otherwise the global
+    default. Every interval is spread by a random jitter so probes are
+    distributed over time instead of arriving in bursts. Results are written
+    in batches of up to `batch_size`, at most `batch_interval` seconds apart.
+    Every `compact_interval` seconds the check history is downsampled with
+    the retention settings in `history`.
+    """
+
+    def __init__(self, checker, db, interval=300, jitter=0.1, refresh_interval=60,
+                 batch_size=50, batch_interval=2, history=None, compact_interval=3600):
+        self.checker = checker
+        self.db = db
+        self.interval = interval
+        self.jitter = jitter
+        self.refresh_interval = refresh_interval
+        self.batch_size = max(1, int(batch_size))
+        self.batch_interval = batch_interval
+        self.history = history or {}
+        self.compact_interval = compact_interval
+        self._hosts = {}
+        self._next_due = {}
+        self._queue = []
+        self._in_flight = set()
+        self._results = []
+        self._batch_started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.checker.workers,
+                                            thread_name_prefix='background-checker')
+        self._thread = threading.Thread(target=self.run, name='background-checker', daemon=True)
+        self._thread.start()
+        print(f'Background checker started: default interval {self.interval}s')
+
+    def stop(self):
+        """Stop the scheduler thread and wait for it to exit"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.flush_results()
+
+    def host_interval(self, host):
+        """Seconds between checks of a host, with jitter applied"""
+        interval = host.get('check_interval') or self.interval
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def refresh_hosts(self):
+        """Reload the host list and schedule hosts that are new"""
+        now = time.monotonic()
+        hosts = {host['id']: host for host in self.db.get_all_hosts() if host.get('url')}
+        for host_id, host in hosts.items():
+            if host_id not in self._next_due:
+                # Spread the first round of checks over one interval
+                due = now + random.uniform(0, host.get('check_interval') or self.interval)
+                self._schedule(host_id, due)
+        for host_id in set(self._next_due) - set(hosts):
+            del self._next_due[host_id]
+        self._hosts = hosts
+
+    def _schedule(self, host_id, due):
+        self._next_due[host_id] = due
+        heapq.heappush(self._queue, (due, host_id))
+
+    def _submit(self, host):
+        with self._lock:
+            self._in_flight.add(host['id'])
+        future = self._executor.submit(self.checker.check_host, host)
+        future.add_done_callback(lambda f, host_id=host['id']: self._on_result(host_id, f))
+
+    def _on_result(self, host_id, future):
+        batch_full = False
+        try:
+            result = future.result()
+            self._remember(result)
+            with self._lock:
+                if not self._results:
+                    self._batch_started = time.monotonic()
+                self._results.append(result)
+                batch_full = len(self._results) >= self.batch_size
+        except Exception as e:
+            print(f'Background check of host {host_id} failed: {e}')
+        finally:
+            with self._lock:
+                self._in_flight.discard(host_id)
+        if batch_full:
+            self.flush_results()
+
+    def _remember(self, result):
+        """Carry probe state over to the next check before the host list is reloaded"""
+        host = self._hosts.get(result['id'])
+        if host is None:
+            return
+        for key in ('resolved_url', 'resolved_scheme', 'latency_state'):
+            if result.get(key) is not None:
+                host[key] = result[key]
+
+    def flush_results(self):
+        """Write all queued results in one transaction"""
+        with self._lock:
+            results, self._results = self._results, []
+            self._batch_started = None
+        if not results:
+            return
+        try:
+            self.db.update_host_statuses(results)
+        except Exception as e:
+            print(f'Background checker could not save {len(results)} results: {e}')
+
+    def _flush_due(self):
+        with self._lock:
+            if self._batch_started is None:
+                return None
+            return self._batch_started + self.batch_interval
+
+    def compact_history(self):
+        """Downsample the check history, unless a sweep just did"""
+        try:
+            compact_history_if_due(self.db, self.history, self.compact_interval)
+        except Exception as e:
+            print(f'Background checker could not compact history: {e}')
+
+    def run(self):
+        """Scheduler loop: probe due hosts until stopped"""
+        next_refresh = 0
+        next_compact = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_refresh:
+                try:
+                    self.refresh_hosts()
+                except Exception as e:
+                    print(f'Background checker could not load hosts: {e}')
+                next_refresh = now + self.refresh_interval
+
+            # The shared lease decides when it is due, this only limits how often to ask
+            if self.compact_interval and now >= next_compact:
+                self.compact_history()
+                next_compact = now + min(self.compact_interval, self.refresh_interval)
+
+            while self._queue and self._queue[0][0] <= now:
+                due, host_id = heapq.heappop(self._queue)
+                if self._next_due.get(host_id) != due:
+                    continue  # Stale entry for a rescheduled or removed host
+                host = self._hosts[host_id]
+                self._schedule(host_id, now + self.host_interval(host))
+                with self._lock:
+                    busy = host_id in self._in_flight
+                if not busy:
+                    self._submit(host)
+
+            flush_at = self._flush_due()
+            if flush_at is not None and flush_at <= time.monotonic():
+                self.flush_results()
+                flush_at = None
+
+            wake_at = next_refresh
+            if self._queue:
+                wake_at = min(wake_at, self._queue[0][0])
+            if flush_at is not None:
+                wake_at = min(wake_at, flush_at)
+            else:
+                # A result may arrive before the next wake up
+                wake_at = min(wake_at, time.monotonic() + self.batch_interval)
+            self._stop.wait(max(0, wake_at - time.monotonic()))
+
+
+def create_checker_instance(config):
+    """Factory function to create a HostChecker from the loaded configuration"""
+    return HostChecker(
+        timeout=config['app']['health_check_timeout'],
+        workers=config['checker']['workers'],
+        host_deadline=config['checker']['host_deadline'],
+        sweep_deadline=config['checker']['sweep_deadline'],
+        keep_alive=config['checker']['keep_alive'],
+        pool_size=config['checker']['pool_size'],
+        head_first=config['checker']['head_first'],
+        max_body_bytes=config['checker']['max_body_bytes']
+    )
+
+
+class LeasedBackgroundChecker:
+    """Runs a BackgroundChecker only while this process holds the scheduler lease
+
+    Every dashboard worker and standalone checker can start one. The lease
+    is a row in the database that its owner renews every third of `ttl`
+    seconds, so exactly one of them probes hosts at a time, and another
+    takes over within `ttl` seconds when the owner stops or dies.
+    """
+
+    LEASE_NAME = 'scheduler'
+
+    def __init__(self, background, db, ttl=30):
+        self.background = background
+        self.db = db
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}'
+        self.leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start competing for the lease"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='scheduler-lease', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background checker if it runs here and give up the lease"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.leader:
+            self.background.stop()
+            self.leader = False
+        try:
+            self.db.release_lease(self.LEASE_NAME, self.owner)
+        except Exception as e:
+            print(f'Warning: Could not release the scheduler lease: {e}')
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                held = self.db.acquire_lease(self.LEASE_NAME, self.owner, self.ttl)
+            except Exception as e:
+                # Without a renewal another process may take over, so stop probing
+                print(f'Warning: Could not renew the scheduler lease: {e}')
+                held = False
+
+            if held and not self.leader:
+                print(f'Scheduler lease acquired by {self.owner}')
+                self.leader = True
+                self.background.start()
+            elif not held and self.leader:
+                print(f'Scheduler lease lost by {self.owner}')
+                self.leader = False
+                self.background.stop()
+
+            self._stop.wait(self.ttl / 3)
+
+
+def create_background_checker(config, checker, db):
+    """Factory function to create a BackgroundChecker from the loaded configuration
+
+    The checker is wrapped in a LeasedBackgroundChecker, so it only runs in
+    the one process that holds the scheduler lease.
+    """
+    background = BackgroundChecker(
+        checker, db,
+        interval=config['checker']['interval'],
+        jitter=config['checker']['jitter'],
+        refresh_interval=config['checker']['refresh_interval'],
+        batch_size=config['checker']['batch_size'],
+        batch_interval=config['checker']['batch_interval'],
+        history=history_settings(config),
+        compact_interval=config['history']['compact_interval']
+    )
+    return LeasedBackgroundChecker(background, db, config['checker']['lease_ttl'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Dashboard background health checker')
+    parser.add_argument('config_file', help='YAML configuration file path')
+    
+    args = parser.parse_args()
+    
+    # Reuse the dashboard's configuration and database setup
+    import dashboard
+    
+    if not dashboard.load_config(args.config_file):
+        sys.exit(1)
+    
+    dashboard.init_paths()
+    dashboard.db.init_database()
+    # Probe metrics are served by the dashboard's /metrics
+    dashboard.share_metrics()
+    
+    background = create_background_checker(dashboard.CONFIG, create_checker_instance(dashboard.CONFIG), dashboard.db)
+    background.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print('Stopping background checker...')
+        background.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,53 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify
-from flask import send_from_directory
+from flask import send_from_directory, Response, stream_with_context, g
+from werkzeug.serving import make_server
 
-import requests
 import json
 import os
+import signal
+import socket
 import sys
+import traceback
+import time
 import argparse
-import yaml
-from pprint import pprint
+import hmac
+import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
 # Import our database module
 from database import create_database_instance
+from checker import create_checker_instance, create_background_checker, compact_history_if_due, history_settings
+from checker import PROBE_TYPES, UNCHECKED_STATUSES
+from assets import AssetStore
+from profiler import StackProfiler
+import metrics
+from icons import IconError, IconBundle, process_icon, store_icon, remove_icon, hidpi_name, icon_class
 
 
-app = Flask(__name__)
+# Static files are served by static_files() below
+app = Flask(__name__, static_folder=None)
 
 # Global variables for configuration and database
 CONFIG = None
 DATABASE_DIR = None
 UPLOAD_FOLDER = None
 DATABASE_FILE = None
+PROFILE_FOLDER = None
+METRICS_FOLDER = None
 db = None  # Database instance
+checker = None  # Health checker instance
+background_checker = None  # Background scheduler instance
+fragment_cache = None  # Rendered category pages
+assets = None  # Fingerprinted, precompressed static files
+icon_bundle = None  # Stylesheet with all icons inlined
+icon_lock = threading.Lock()  # Keeps icon files from being deleted while a host takes them
+startup_started = None  # When the server process started, None for restarted workers
+
+# Time until the response headers, streamed bodies are not included
+REQUEST_SECONDS = metrics.Histogram('dashboard_request_seconds', 'Duration of HTTP requests',
+                                    ['route', 'method', 'status'])
 
 # Default configuration values
 DEFAULT_CONFIG = {
@@ -29,16 +55,64 @@ DEFAULT_CONFIG = {
         'name': 'Dashboard',
         'max_upload_size': 5,
         'allowed_extensions': ['png', 'jpg', 'jpeg', 'gif', 'svg'],
-        'health_check_timeout': 5
+        'health_check_timeout': 5,
+        'icon_size': 64,
+        'icon_format': 'webp',
+        'icon_bundle': False,
+        'page_size': 48,
+        'fragment_cache_size': 512
+    },
+    'checker': {
+        'workers': 16,
+        'host_deadline': 10,
+        'sweep_deadline': 30,
+        'keep_alive': True,
+        'pool_size': 64,
+        'head_first': True,
+        'max_body_bytes': 65536,
+        'background': False,
+        'interval': 300,
+        'jitter': 0.1,
+        'refresh_interval': 60,
+        'batch_size': 50,
+        'batch_interval': 2,
+        'lease_ttl': 30
+    },
+    'history': {
+        'raw_days': 7,
+        'hourly_days': 90,
+        'daily_days': 730,
+        'compact_interval': 3600
     },
     'database': {
         'file': './dashboard_data/dashboard.db',
-        'icons_dir': 'icons'
+        'icons_dir': 'icons',
+        'pool_size': 8,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 268435456,
+        'cache_size': -16000,
+        'cache': True,
+        'slow_query_ms': 0
+    },
+    'metrics': {
+        'dir': 'metrics',
+        'flush_interval': 5
+    },
+    'profiling': {
+        'enabled': False,
+        'token': '',
+        'dir': 'profiles',
+        'min_ms': 0,
+        'interval_ms': 1
     },
     'server': {
         'host': '0.0.0.0',
         'port': 8003,
-        'debug': True
+        'debug': True,
+        'mode': 'development',
+        'workers': 4
     }
 }
 
@@ -76,19 +150,120 @@ def file_extension(filename):
     return fextension
 
 
+def read_icon(icon_file):
+    """Read and process an uploaded icon, returns (extension, variants) or None if unusable"""
+    try:
+        return process_icon(icon_file.read(), file_extension(icon_file.filename),
+                            CONFIG['app']['icon_size'], CONFIG['app']['icon_format'])
+    except IconError as e:
+        print(f'Warning: Ignoring icon {icon_file.filename}: {e}')
+        return None
+
+
+def release_unused_icons():
+    """Delete the icon files no host refers to anymore"""
+    def remove(icon):
+        remove_icon(UPLOAD_FOLDER, icon)
+        print(f'Deleted unused icon: {icon}')
+    
+    with icon_lock:
+        db.take_unused_icons(remove)
+
+
+app.add_template_filter(icon_class)
+
+
+@app.template_filter('icon_2x')
+def icon_2x(icon):
+    """Get the 2x variant of an uploaded icon if there is one, for srcset"""
+    fname = hidpi_name(icon)
+    return fname if os.path.exists(os.path.join(UPLOAD_FOLDER, fname)) else None
+
+
+class FragmentCache:
+    """Rendered HTML fragments, each stored with the data version it was rendered from
+    
+    A fragment is only returned while its version still matches, so a
+    change re-renders just the fragments of the category it touched. The
+    least recently used fragments are dropped beyond `max_entries`.
+    """
+    
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, version, html):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
 @app.route('/')
 def index():
-    hosts = db.get_all_hosts()
+    # Only the category headers are rendered, hosts are loaded per category on demand
+    categories = db.get_category_summaries()
+    return render_template('index.html', categories=categories, dashboard_name=CONFIG['app']['name'],
+                           page_size=CONFIG['app']['page_size'])
+
+@app.route('/category/<category_id>/hosts')
+def category_hosts(category_id):
+    """Get a page of the hosts of a category as card markup, or JSON with ?format=json
+    
+    Pages are ordered by name and continue after the host given by
+    after_name and after_id, which the previous page returns as its cursor.
+    """
+    limit = max(1, min(request.args.get('limit', CONFIG['app']['page_size'], type=int), 500))
+    after_id = request.args.get('after_id', type=int)
+    after = (request.args.get('after_name', ''), after_id) if after_id is not None else None
     
-    for host in hosts:
-        tooltip = "<b>Notes:</b><br> " + (host['notes'] if host['notes'] else 'No notes') + "<br>"
-        # Add placeholder for last checked time - will be updated by JavaScript
-        if host['last_checked']:
-            tooltip += "<b>Last checked:</b><br><span class='relative-time'>Loading...</span>"
-        host['tooltip'] = tooltip
+    if request.args.get('format') == 'json':
+        hosts, cursor = load_category_page(int(category_id), limit, after)
+        return jsonify({'hosts': [public_host(host) for host in hosts], 'next': cursor})
+    
+    # A page stays valid until a host of the category is added, changed,
+    # moved or deleted, which changes its version or host count
+    summary = next((category for category in db.get_category_summaries()
+                    if category['id'] == int(category_id)), None)
+    version = (summary['version'], summary['hosts']) if summary else None
+    key = (int(category_id), limit, after)
+    
+    html = fragment_cache.get(key, version) if version else None
+    if html is None:
+        hosts, cursor = load_category_page(int(category_id), limit, after)
+        html = render_template('_host_cards.html', hosts=hosts, category_id=category_id, cursor=cursor)
+        if version:
+            fragment_cache.put(key, version, html)
+    return with_icon_bundle(html)
 
-    return render_template('index.html', hosts=hosts, dashboard_name=CONFIG['app']['name'])
+def with_icon_bundle(html):
+    """Tell the page which icon bundle has the icons of a page of cards"""
+    response = Response(html)
+    if CONFIG['app']['icon_bundle']:
+        response.headers['X-Icon-Bundle'] = icon_bundle_url()
+    return response
 
+def load_category_page(category_id, limit, after):
+    """Get a page of the hosts of a category and the cursor of the next page, if any"""
+    # One extra host tells whether there is a next page
+    hosts = db.get_category_hosts(category_id, limit + 1, after)
+    cursor = None
+    if len(hosts) > limit:
+        hosts = hosts[:limit]
+        cursor = {'after_name': hosts[-1]['name'], 'after_id': hosts[-1]['id']}
+    return hosts, cursor
 
 
 @app.route('/update_host/<host_id>', methods=['GET', 'POST'])
@@ -101,6 +276,10 @@ def update_host(host_id):
         notes = clean_text_input(request.form['notes'])
         location = clean_text_input(request.form['location'])
         category_id = request.form.get('category_id')
+        check_interval = request.form.get('check_interval', '').strip()
+        probe_type = request.form.get('probe_type', 'http')
+        if probe_type not in dict(PROBE_TYPES):
+            probe_type = 'http'
 
         host_data = {
             'name': name,
@@ -108,43 +287,36 @@ def update_host(host_id):
             'notes': notes,
             'location': location,
             'status': 'unknown',
-            'last_checked': None
+            'last_checked': None,
+            'probe_type': probe_type
         }
         
         # Only add category if one is selected
         if category_id and category_id != '':
             host_data['category_id'] = int(category_id)
 
+        # Only override the default check interval if one is given
+        if check_interval.isdigit() and int(check_interval) > 0:
+            host_data['check_interval'] = int(check_interval)
+
         # Handle icon upload
         if KEY_ICON in request.files:
             iconFile = request.files[KEY_ICON]
+            icon = None
             if iconFile and iconFile.filename != '' and allowed_file(iconFile.filename):
-                # Generate filename
-                if host_id == 0:
-                    # For new hosts, we need to save first to get the ID
-                    saved_host_id = db.save_host(host_data)
-                    saved_filename = str(saved_host_id) + file_extension(iconFile.filename)
-                else:
-                    # For updates, delete the old icon file first
-                    existing_host = db.get_host_by_id(host_id)
-                    if existing_host and existing_host.get('icon'):
-                        old_icon_path = os.path.join(UPLOAD_FOLDER, existing_host['icon'])
-                        try:
-                            os.remove(old_icon_path)
-                            print(f'Deleted old icon: {existing_host["icon"]}')
-                        except FileNotFoundError:
-                            pass
-                    
-                    saved_filename = str(host_id) + file_extension(iconFile.filename)
-                    saved_host_id = host_id
-
-                # Save the file
-                path = os.path.join(UPLOAD_FOLDER, saved_filename)
-                iconFile.save(path)
-                host_data['icon'] = saved_filename
+                icon = read_icon(iconFile)
+            if icon:
+                icon_extension, icon_variants = icon
+                with icon_lock:
+                    # Save the resized icon and its 2x variant, or reuse an identical stored icon
+                    host_data['icon'] = store_icon(UPLOAD_FOLDER, icon_extension, icon_variants)
+                    db.save_host(host_data, host_id if host_id != 0 else None)
+                    # Another worker may have deleted the shared file before our reference
+                    # was counted, writing it again now that it is held is safe
+                    store_icon(UPLOAD_FOLDER, icon_extension, icon_variants)
                 
-                # Update the host with icon info
-                db.save_host(host_data, saved_host_id)
+                # The previous icon may not be used by any other host
+                release_unused_icons()
             else:
                 # No new icon, just save the host
                 if host_id == 0:
@@ -178,34 +350,146 @@ def update_host(host_id):
     print(existing_host)
 
     categories = db.get_all_categories()
-    return render_template('update_host.html', host=existing_host, categories=categories, dashboard_name=CONFIG['app']['name'])
+    return render_template('update_host.html', host=existing_host, categories=categories, probe_types=PROBE_TYPES,
+                           dashboard_name=CONFIG['app']['name'])
+
+
+@app.template_global()
+def asset_url(filename):
+    """Get the fingerprinted URL of a static file, for templates"""
+    if assets is None:
+        return '/static/' + filename
+    return assets.url(filename)
+
+
+def asset_response(asset, immutable):
+    """Serve an in-memory asset in the best encoding the client accepts"""
+    if request.if_none_match.contains(asset.etag):
+        response = Response(status=304)
+    else:
+        encoding, data = asset.select(request.headers.get('Accept-Encoding'))
+        response = Response(data, mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(asset.etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if immutable:
+        # A fingerprinted URL always has the same content
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
-    """Serve static files (CSS, JS, etc.)"""
-    static_dir = os.path.join(os.path.dirname(__file__), 'static')
-    return send_from_directory(static_dir, filename)
+    """Serve static files (CSS, JS, etc.) from memory in the best encoding the client accepts"""
+    asset, fingerprinted = assets.lookup(filename) if assets is not None else (None, False)
+    if asset is None:
+        static_dir = os.path.join(os.path.dirname(__file__), 'static')
+        return send_from_directory(static_dir, filename)
+    return asset_response(asset, fingerprinted)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # The route pattern, not the path, keeps the number of series bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+    return response
+
+
+@app.teardown_request
+def record_failed_request_time(error):
+    # Requests that raised never reached after_request
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method, '500')
+
+
+def profiling_requested():
+    """Check whether the current request should be profiled
+    
+    Every request is profiled when profiling is enabled in the configuration,
+    otherwise only requests with ?profile=<token> when a token is configured.
+    """
+    settings = CONFIG['profiling']
+    if settings['enabled']:
+        return True
+    token = request.args.get('profile')
+    return bool(settings['token'] and token and hmac.compare_digest(token, str(settings['token'])))
+
+
+@app.before_request
+def start_profiler():
+    if profiling_requested():
+        g.profiler = StackProfiler(f'{request.method} {request.path}',
+                                   interval=CONFIG['profiling']['interval_ms'] / 1000).start()
+
+
+@app.teardown_request
+def write_profile(error):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.stop()
+    elapsed_ms = profiler.elapsed * 1000
+    if elapsed_ms < CONFIG['profiling']['min_ms']:
+        return
+    
+    name = re.sub(r'[^A-Za-z0-9_-]+', '_', request.path).strip('_') or 'index'
+    fname = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.method}-{name}-{int(elapsed_ms)}ms.folded"
+    path = os.path.join(PROFILE_FOLDER, fname)
+    profiler.write(path)
+    print(f'Profile of {request.method} {request.path} ({elapsed_ms:.1f} ms) written to {path}')
+
+
+@app.context_processor
+def inject_icon_bundle():
+    return {'icon_bundle': CONFIG['app']['icon_bundle']}
+
+
+@app.template_global()
+def icon_bundle_url():
+    """Get the URL of the current icon bundle"""
+    return f'/icons/{icon_bundle.update(db.get_icon_names()).digest}.css'
+
+
+@app.route('/icons/<digest>.css')
+def icon_bundle_css(digest):
+    """Serve all icons in use as one stylesheet of data URIs
+    
+    The bundle is rebuilt when icons are added or removed. An outdated
+    digest still gets the current bundle, but without long-term caching.
+    """
+    asset = icon_bundle.update(db.get_icon_names())
+    return asset_response(asset, digest == asset.digest)
 
 
 @app.route('/img/<path:fname>')
 def send_image(fname):
     #print(f'Wants an image: {fname}')
-    return send_from_directory(UPLOAD_FOLDER, fname, as_attachment=False)
+    response = send_from_directory(UPLOAD_FOLDER, fname, as_attachment=False)
+    # Icon files are named after their content and never change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 @app.route('/delete_host/<host_id>', endpoint='delete_host')
 def delete_host_route(host_id):
-    host = db.get_host_by_id(int(host_id))
-    
-    if host and host.get('icon'):
-        path = os.path.join(UPLOAD_FOLDER, host['icon'])
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            pass
-
     db.delete_host(int(host_id))
+    
+    # Other hosts may still use the same icon
+    release_unused_icons()
     return redirect(url_for('index'))
 
 
@@ -249,6 +533,9 @@ def load_config(config_file):
     """Load configuration from YAML file"""
     global CONFIG
     
+    # Only needed once at startup
+    import yaml
+    
     try:
         with open(config_file, 'r') as f:
             CONFIG = yaml.safe_load(f)
@@ -279,11 +566,15 @@ def load_config(config_file):
 
 def init_paths():
     """Initialize the global path variables based on the configuration"""
-    global DATABASE_DIR, UPLOAD_FOLDER, DATABASE_FILE, db
+    global DATABASE_DIR, UPLOAD_FOLDER, DATABASE_FILE, PROFILE_FOLDER, METRICS_FOLDER, db, fragment_cache, icon_bundle
     
     DATABASE_FILE = os.path.abspath(CONFIG['database']['file'])
     DATABASE_DIR = os.path.dirname(DATABASE_FILE)
     UPLOAD_FOLDER = os.path.join(DATABASE_DIR, CONFIG['database']['icons_dir'])
+    # Created when the first profile is written
+    PROFILE_FOLDER = os.path.join(DATABASE_DIR, CONFIG['profiling']['dir'])
+    # Shared by the processes that report metrics, see share_metrics()
+    METRICS_FOLDER = os.path.join(DATABASE_DIR, CONFIG['metrics']['dir'])
     
     # Create directories if they don't exist
     if not os.path.exists(DATABASE_DIR):
@@ -299,65 +590,232 @@ def init_paths():
     app.config['MAX_CONTENT_LENGTH'] = CONFIG['app']['max_upload_size'] * 1024 * 1024  # Convert MB to bytes
     
     # Initialize database
-    db = create_database_instance(DATABASE_FILE)
+    db = create_database_instance(DATABASE_FILE, CONFIG['database'])
+    fragment_cache = FragmentCache(CONFIG['app']['fragment_cache_size'])
+    icon_bundle = IconBundle(UPLOAD_FOLDER)
     
     print(f'Database directory: {DATABASE_DIR}')
     print(f'Icons folder: {UPLOAD_FOLDER}')
     print(f'Database file: {DATABASE_FILE}')
 
 
-# Health check functionality
-def check_host_status(url):
-    """Check if a host is reachable"""
-    timeout = CONFIG['app']['health_check_timeout']
+def init_assets():
+    """Load, fingerprint and precompress the static files"""
+    global assets
+    
+    assets = AssetStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    count, plain, compressed = assets.summary()
+    print(f'Static assets: {count} files, {plain} bytes, {compressed} bytes compressed')
+
+
+def init_checker():
+    """Initialize the health checker based on the configuration"""
+    global checker
+
+    checker = create_checker_instance(CONFIG)
+    print(f'Health checker: {checker.workers} workers')
+
+
+def share_metrics():
+    """Report the metrics of this process through the shared metrics folder"""
+    metrics.share(METRICS_FOLDER, CONFIG['metrics']['flush_interval'])
+
+
+def start_background_checker():
+    """Start the in-process background checker if enabled in the configuration"""
+    global background_checker
+
+    if not CONFIG['checker']['background']:
+        return
+
+    # With the debug reloader only the child process serves requests
+    if (CONFIG['server']['mode'] != 'production' and CONFIG['server']['debug']
+            and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'):
+        return
+
+    background_checker = create_background_checker(CONFIG, checker, db)
+    background_checker.start()
+
+
+def report_ready():
+    """Log how long after start the server is about to serve from a bound socket"""
+    if startup_started is not None:
+        print(f'Ready for requests in {(time.monotonic() - startup_started) * 1000:.1f} ms (pid {os.getpid()})')
+
+
+def run_worker(listener):
+    """Serve requests from a listening socket shared with the other workers"""
+    def stop_worker(signum, frame):
+        # The parent and the process group both signal us, a second signal
+        # must not interrupt the cleanup that releases the scheduler lease
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        raise SystemExit(0)
+    
+    # Let SIGTERM and Ctrl-C unwind serve_forever()
+    signal.signal(signal.SIGTERM, stop_worker)
+    signal.signal(signal.SIGINT, stop_worker)
+    
+    share_metrics()
+    start_background_checker()
+    server = make_server(CONFIG['server']['host'], CONFIG['server']['port'], app,
+                         threaded=True, fd=listener.fileno())
+    report_ready()
     try:
-        # Remove any trailing slashes and handle different URL formats
-        clean_url = url.rstrip('/')
-        if not clean_url.startswith(('http://', 'https://')):
-            # Try both http and https
-            for protocol in ['http://', 'https://']:
-                try:
-                    test_url = protocol + clean_url
-                    response = requests.get(test_url, timeout=timeout)
-                    return 'online' if response.status_code < 400 else 'offline'
-                except:
-                    continue
-            return 'offline'
-        else:
-            response = requests.get(clean_url, timeout=timeout)
-            return 'online' if response.status_code < 400 else 'offline'
-    except:
-        return 'offline'
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if background_checker:
+            background_checker.stop()
+        server.server_close()
+        # Workers leave with os._exit(), which skips the atexit flush
+        metrics.flush()
+
+
+def serve_production():
+    """Serve with several worker processes behind one listening socket
+    
+    The parent process only binds the socket and restarts workers that
+    exit. Every worker runs a threaded server, and competes for the
+    scheduler lease when the background checker is enabled.
+    """
+    global startup_started
+    host = CONFIG['server']['host']
+    port = CONFIG['server']['port']
+    workers = max(1, int(CONFIG['server']['workers']))
+    
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    listener = socket.create_server((host, port), family=family, backlog=128)
+    # Workers that lose the race for a connection return to their loop instead of blocking
+    listener.setblocking(False)
+    
+    # Database connections must not be shared with the forked workers
+    db.close()
+    
+    children = set()
+    stopping = False
+    
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(listener)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+    
+    def shutdown(signum, frame):
+        nonlocal stopping
+        # Ctrl-C or systemd may signal the parent more than once
+        if stopping:
+            return
+        stopping = True
+        # Workers that were signalled with the process group ignore this one
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    
+    for _ in range(workers):
+        spawn()
+    print(f'Serving on http://{host}:{port} with {workers} worker processes')
+    # Workers restarted later don't report how long the server took to start
+    startup_started = None
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f'Worker {pid} exited with status {status}, starting a new one')
+            time.sleep(1)
+            spawn()
+    
+    listener.close()
+    print('All workers stopped')
+
+
+def compact_history_soon():
+    """Downsample the check history in the background once compact_interval has passed
+    
+    Checks run from the web pages add history too, so compaction must not
+    depend on the background checker being enabled.
+    """
+    threading.Thread(target=compact_history_if_due, name='compaction', daemon=True,
+                     args=(db, history_settings(CONFIG), CONFIG['history']['compact_interval'])).start()
+
+
+def public_result(result):
+    """The fields of a check result that are exposed as JSON"""
+    keys = ('id', 'status', 'last_checked', 'latency_ms', 'connect_ms', 'ttfb_ms',
+            'latency_p50', 'latency_p95', 'latency_p99')
+    return {key: result.get(key) for key in keys}
+
+
+def public_host(host):
+    """A host row without the checker's internal state, as exposed as JSON"""
+    return {key: value for key, value in host.items() if key != 'latency_state'}
+
+
+def sweep_summary(counts):
+    """The totals reported when a Check All sweep ends, from a count of results per status
+    
+    Hosts cut off by the sweep deadline are reported apart, they were not checked.
+    """
+    online = counts.get('online', 0)
+    offline = counts.get('offline', 0)
+    timeout = counts.get('timeout', 0)
+    skipped = counts.get('skipped', 0)
+    message = f'Checked {online + offline} hosts: {online} online, {offline} offline'
+    if timeout or skipped:
+        message += f'; {timeout} still running and {skipped} not started at the sweep deadline'
+    return {
+        'success': True,
+        'checked': online + offline,
+        'online': online,
+        'offline': offline,
+        'timeout': timeout,
+        'skipped': skipped,
+        'message': message
+    }
+
 
 @app.route('/check_host/<host_id>')
 def check_single_host(host_id):
     """Check status of a single host"""
     host = db.get_host_by_id(int(host_id))
     if host and host['url']:
-        status = check_host_status(host['url'])
-        last_checked = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        db.update_host_status(int(host_id), status, last_checked)
+        result = checker.check_host(host)
+        db.update_host_statuses([result])
+        compact_history_soon()
     return redirect(url_for('index'))
 
 @app.route('/check_all_hosts')
 def check_all_hosts():
     """Check status of all hosts"""
     hosts = db.get_all_hosts()
-    checked_count = 0
-    online_count = 0
-    offline_count = 0
-    
-    for host in hosts:
-        if host['url']:
-            status = check_host_status(host['url'])
-            last_checked = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            db.update_host_status(host['id'], status, last_checked)
-            checked_count += 1
-            
-            if status == 'online':
-                online_count += 1
-            else:
-                offline_count += 1
+    counts = {}
+    
+    results = checker.check_hosts(hosts)
+    # Hosts cut off by the sweep deadline keep their last status
+    db.update_host_statuses([result for result in results if result['status'] not in UNCHECKED_STATUSES])
+    compact_history_soon()
+    
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
     
     # Check if this is an AJAX request by looking for XMLHttpRequest header or JSON accept header
     is_ajax = (
@@ -367,28 +825,145 @@ def check_all_hosts():
     )
     
     if is_ajax:
-        return jsonify({
-            'success': True,
-            'checked': checked_count,
-            'online': online_count,
-            'offline': offline_count,
-            'message': f'Checked {checked_count} hosts: {online_count} online, {offline_count} offline'
-        })
+        return jsonify(dict(sweep_summary(counts), results=[public_result(result) for result in results]))
     else:
         # Regular browser request - redirect as before
         return redirect(url_for('index'))
 
+@app.route('/check_all_hosts/stream')
+def check_all_hosts_stream():
+    """Check status of all hosts, streaming each result as a Server-Sent Event"""
+    hosts = db.get_all_hosts()
+    flush_size = CONFIG['checker']['batch_size']
+    flush_interval = CONFIG['checker']['batch_interval']
+    
+    def event(name, data):
+        return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+    
+    def generate():
+        pending = []
+        last_flush = time.monotonic()
+        counts = {}
+        try:
+            yield event('start', {'total': len([host for host in hosts if host['url']])})
+            for result in checker.iter_results(hosts):
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                
+                # Save in small batches so results survive a closed connection,
+                # hosts cut off by the sweep deadline keep their last status
+                if result['status'] not in UNCHECKED_STATUSES:
+                    pending.append(result)
+                if len(pending) >= flush_size or time.monotonic() - last_flush >= flush_interval:
+                    db.update_host_statuses(pending)
+                    pending = []
+                    last_flush = time.monotonic()
+                
+                yield event('result', public_result(result))
+            
+            db.update_host_statuses(pending)
+            pending = []
+            compact_history_soon()
+            yield event('done', sweep_summary(counts))
+        finally:
+            if pending:
+                db.update_host_statuses(pending)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+    })
+
+@app.route('/host_history/<host_id>')
+def host_history(host_id):
+    """Get uptime and outage windows of a host over the last `days` days"""
+    days = request.args.get('days', 7, type=int)
+    end = int(datetime.now().timestamp())
+    start = end - days * 86400
+    
+    uptime = db.get_uptime(int(host_id), start, end)
+    outages = db.get_outages(int(host_id), start, end)
+    return jsonify({
+        'host_id': int(host_id),
+        'start': start,
+        'end': end,
+        'uptime': round(uptime, 3) if uptime is not None else None,
+        'outages': outages
+    })
+
 @app.route('/open_host/<host_id>')
 def open_host(host_id):
     """Redirect to host URL"""
     host = db.get_host_by_id(int(host_id))
     if host and host.get('url'):
-        url = host['url']
+        # Prefer the URL the last successful health check ended up at
+        url = host.get('resolved_url') or host['url']
         if not url.startswith(('http://', 'https://')):
             url = 'http://' + url
         return redirect(url)
     return redirect(url_for('index'))
 
+def versioned_response(version, since, load_all, load_since, key):
+    """Build a JSON response for a versioned listing with ETag and delta support
+    
+    The data version is read before the data, so a client that stores it
+    and passes it back as `since` never misses a change.
+    """
+    etag = f'{key}-{version}-{since if since is not None else "all"}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    if since is None:
+        items, deleted = load_all(), []
+    else:
+        items, deleted = load_since(since)
+    
+    response = jsonify({
+        'version': version,
+        'full': since is None,
+        key: items,
+        'deleted': deleted
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/hosts')
+def api_hosts():
+    """Get all hosts, or with ?since=<version> only the hosts changed or deleted since"""
+    version = db.get_data_version()
+    since = request.args.get('since', type=int)
+    
+    def load_all():
+        return [public_host(host) for host in db.get_all_hosts()]
+    
+    def load_since(since):
+        hosts, deleted = db.get_hosts_since(since)
+        return [public_host(host) for host in hosts], deleted
+    
+    return versioned_response(version, since, load_all, load_since, 'hosts')
+
+@app.route('/api/categories')
+def api_categories():
+    """Get all categories, or with ?since=<version> only the categories changed or deleted since"""
+    version = db.get_data_version()
+    since = request.args.get('since', type=int)
+    return versioned_response(version, since, db.get_all_categories, db.get_categories_since, 'categories')
+
+@app.route('/search')
+def search():
+    """Full-text search over hosts, ranked, with prefix matching
+    
+    Returns JSON, or the card markup of the matches with ?format=html.
+    """
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 50, type=int), 1000))
+    hosts = db.search_hosts(query, limit)
+    if request.args.get('format') == 'html':
+        return with_icon_bundle(render_template('_host_cards.html', hosts=hosts, cursor=None))
+    return jsonify({'query': query, 'hosts': [public_host(host) for host in hosts]})
+
 @app.route('/locations')
 def get_locations():
     """Get all unique locations from existing hosts"""
@@ -399,7 +974,25 @@ def get_locations():
     return jsonify({'locations': location_list})
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request, database and probe metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
+    # CPU time spent so far is almost all module imports
+    import_seconds = time.process_time()
+    startup = []
+    phase_started = startup_started = time.monotonic()
+    
+    def startup_phase(name):
+        """Record how long the startup phase that just finished took"""
+        global phase_started
+        now = time.monotonic()
+        startup.append((name, now - phase_started))
+        phase_started = now
+    
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Network Dashboard Management System')
     parser.add_argument('config_file', help='YAML configuration file path')
@@ -409,25 +1002,48 @@ if __name__ == '__main__':
     # Load configuration from YAML file
     if not load_config(args.config_file):
         sys.exit(1)
+    startup_phase('config')
     
     # Initialize paths and database
     init_paths()
+    startup_phase('init_paths')
     
     # Initialize database tables
     db.init_database()
+    startup_phase('init_database')
+    
+    # Prepare static files
+    init_assets()
+    startup_phase('assets')
+    
+    # Initialize health checker
+    init_checker()
+    startup_phase('checker')
     
     # Log database contents on startup
     try:
-        hosts = db.get_all_hosts()
-        categories = db.get_all_categories()
-        print(f"Database loaded: {len(hosts)} hosts, {len(categories)} categories")       
-
+        counts = db.get_counts()
+        print(f"Database loaded: {counts['hosts']} hosts, {counts['categories']} categories")
     except Exception as e:
         print(f"Warning: Could not load database statistics: {e}")
+    startup_phase('statistics')
+    
+    total = sum(seconds for _, seconds in startup)
+    print('Startup: ' + ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in startup)
+          + f', initialized in {total * 1000:.1f} ms (imports {import_seconds * 1000:.0f} ms CPU)')
 
+    # Counters restart with the server, like in any single process
+    metrics.clear_shared(METRICS_FOLDER)
+    
     # Start the Flask app
-    app.run(
-        debug=CONFIG['server']['debug'],
-        host=CONFIG['server']['host'],
-        port=CONFIG['server']['port']
-    )
\ No newline at end of file
+    if CONFIG['server']['mode'] == 'production' and hasattr(os, 'fork'):
+        serve_production()
+    else:
+        share_metrics()
+        start_background_checker()
+        report_ready()
+        app.run(
+            debug=CONFIG['server']['debug'],
+            host=CONFIG['server']['host'],
+            port=CONFIG['server']['port']
+        )
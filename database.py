@@ -5,183 +5,954 @@ Handles all SQLite database interactions for hosts and categories.
 
 import sqlite3
 import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from metrics import Counter, Histogram, timed_methods
 
+
+# Bucket sizes of the check history rollups, in seconds
+HOURLY = 3600
+DAILY = 86400
+
+# Default connection settings, overridable from the database section of the config
+DEFAULT_SETTINGS = {
+    'pool_size': 8,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,       # milliseconds
+    'mmap_size': 268435456,     # bytes (256 MB)
+    'cache_size': -16000,       # negative = KiB (16 MB), positive = pages
+    'slow_query_ms': 0          # log statements slower than this, 0 = disabled
+}
+
+# Longest parameter list printed by the slow-query log
+MAX_LOGGED_PARAMETERS = 200
+
+# Calls to the database methods, cache hits of CachedDashboardDatabase are not included
+QUERY_SECONDS = Histogram('dashboard_db_query_seconds', 'Duration of DashboardDatabase method calls', ['method'])
+SLOW_QUERIES = Counter('dashboard_db_slow_queries_total', 'Statements slower than slow_query_ms')
+
+
+class SlowQueryConnection(sqlite3.Connection):
+    """Connection that prints every statement slower than slow_query_seconds
+    
+    Only the execute call is timed. Rows that are fetched afterwards are
+    not included, though sorting and aggregation happen before the first row.
+    """
+    
+    slow_query_seconds = None
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._log_slow(start, sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._log_slow(start, sql, '(executemany)')
+    
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._log_slow(start, sql_script, '(script)')
+    
+    def _log_slow(self, start, sql, parameters):
+        elapsed = time.perf_counter() - start
+        if self.slow_query_seconds is None or elapsed < self.slow_query_seconds:
+            return
+        SLOW_QUERIES.inc()
+        parameters = repr(parameters) if not isinstance(parameters, str) else parameters
+        if len(parameters) > MAX_LOGGED_PARAMETERS:
+            parameters = parameters[:MAX_LOGGED_PARAMETERS] + '...'
+        print(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(sql.split())} {parameters}")
+
+
+@timed_methods(QUERY_SECONDS, exclude=('connection', 'get_connection', 'close'))
 class DashboardDatabase:
     """Database class to handle all SQLite operations for the dashboard"""
     
-    def __init__(self, db_file):
+    def __init__(self, db_file, settings=None):
         self.db_file = db_file
+        self.settings = dict(DEFAULT_SETTINGS)
+        for key, value in (settings or {}).items():
+            if key in DEFAULT_SETTINGS:
+                self.settings[key] = value
+        self._pool = queue.LifoQueue(maxsize=max(1, int(self.settings['pool_size'])))
+        self.fts_enabled = True
     
     def get_connection(self):
-        """Get database connection with Row factory"""
-        conn = sqlite3.connect(self.db_file)
+        """Open a new database connection with Row factory and tuned settings"""
+        slow_query_ms = self.settings['slow_query_ms']
+        conn = sqlite3.connect(self.db_file,
+                               timeout=self.settings['busy_timeout'] / 1000,
+                               check_same_thread=False,
+                               factory=SlowQueryConnection if slow_query_ms else sqlite3.Connection)
+        if slow_query_ms:
+            conn.slow_query_seconds = slow_query_ms / 1000
         conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={self.settings['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous={self.settings['synchronous']}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.settings['busy_timeout'])}")
+        conn.execute(f"PRAGMA mmap_size={int(self.settings['mmap_size'])}")
+        conn.execute(f"PRAGMA cache_size={int(self.settings['cache_size'])}")
         return conn
     
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection for the duration of a with block
+        
+        Connections are opened on demand and kept for reuse, up to pool_size
+        idle connections. Any transaction left open is rolled back on return.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self.get_connection()
+        
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    def close(self):
+        """Close all idle pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
     def init_database(self):
         """Initialize the SQLite database with required tables"""
-        conn = self.get_connection()
-        
-        # Create categories table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT
-            )
+        with self.connection() as conn:
+            # Create categories table
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS categories (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            
+            # Create hosts table
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS hosts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    location TEXT,
+                    notes TEXT,
+                    status TEXT DEFAULT 'unknown',
+                    last_checked DATETIME,
+                    icon TEXT,
+                    category_id INTEGER,
+                    check_interval INTEGER,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    resolved_url TEXT,
+                    resolved_scheme TEXT,
+                    latency_ms INTEGER,
+                    connect_ms INTEGER,
+                    ttfb_ms INTEGER,
+                    latency_p50 INTEGER,
+                    latency_p95 INTEGER,
+                    latency_p99 INTEGER,
+                    latency_state TEXT,
+                    probe_type TEXT NOT NULL DEFAULT 'http',
+                    FOREIGN KEY (category_id) REFERENCES categories (id)
+                )
+            ''')
+            
+            # Add columns introduced after the first release
+            self._ensure_column(conn, 'hosts', 'check_interval', 'INTEGER')
+            self._ensure_column(conn, 'hosts', 'version', 'INTEGER NOT NULL DEFAULT 0')
+            self._ensure_column(conn, 'categories', 'version', 'INTEGER NOT NULL DEFAULT 0')
+            self._ensure_column(conn, 'hosts', 'resolved_url', 'TEXT')
+            self._ensure_column(conn, 'hosts', 'resolved_scheme', 'TEXT')
+            for column in ('latency_ms', 'connect_ms', 'ttfb_ms', 'latency_p50', 'latency_p95', 'latency_p99'):
+                self._ensure_column(conn, 'hosts', column, 'INTEGER')
+            self._ensure_column(conn, 'hosts', 'latency_state', 'TEXT')
+            self._ensure_column(conn, 'hosts', 'probe_type', "TEXT NOT NULL DEFAULT 'http'")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_hosts_version ON hosts (version)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_categories_version ON categories (version)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_hosts_category_name ON hosts (category_id, name, id)')
+            
+            # Create the data version counter, bumped by every write
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO sync_state (id, version) VALUES (1, 0)')
+            
+            # Create tombstones so delta sync can report deletions
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tombstones (
+                    kind TEXT NOT NULL,
+                    item_id INTEGER NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (kind, item_id)
+                )
+            ''')
+            
+            # Create check history table (status: 1 = online, 0 = offline)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS check_results (
+                    host_id INTEGER NOT NULL,
+                    checked_at INTEGER NOT NULL,
+                    status INTEGER NOT NULL,
+                    latency_ms INTEGER,
+                    PRIMARY KEY (host_id, checked_at)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_check_results_time ON check_results (checked_at)')
+            
+            # Create hourly and daily rollups of downsampled check history
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS check_rollups (
+                    host_id INTEGER NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    checks INTEGER NOT NULL,
+                    online INTEGER NOT NULL,
+                    latency_sum INTEGER NOT NULL,
+                    latency_max INTEGER,
+                    PRIMARY KEY (host_id, resolution, bucket)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_check_rollups_time ON check_rollups (resolution, bucket)')
+            
+            # Create leases table, used to elect the one process that runs the scheduler
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            
+            self._init_search(conn)
+            self._init_icon_refs(conn)
+            
+            conn.commit()
+        print("Database initialized successfully")
+    
+    def _init_search(self, conn):
+        """Create the full-text search index over hosts, kept in sync by triggers"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hosts_fts'").fetchone()
+        try:
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS hosts_fts USING fts5 (
+                    name, url, location, notes, category_name,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            self.fts_enabled = False
+            print(f"Warning: full-text search unavailable, falling back to LIKE: {e}")
+            return
+        
+        conn.executescript('''
+            CREATE TRIGGER IF NOT EXISTS hosts_fts_insert AFTER INSERT ON hosts BEGIN
+                INSERT INTO hosts_fts (rowid, name, url, location, notes, category_name)
+                VALUES (new.id, new.name, new.url, new.location, new.notes,
+                        (SELECT name FROM categories WHERE id = new.category_id));
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_fts_update
+            AFTER UPDATE OF name, url, location, notes, category_id ON hosts BEGIN
+                DELETE FROM hosts_fts WHERE rowid = old.id;
+                INSERT INTO hosts_fts (rowid, name, url, location, notes, category_name)
+                VALUES (new.id, new.name, new.url, new.location, new.notes,
+                        (SELECT name FROM categories WHERE id = new.category_id));
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_fts_delete AFTER DELETE ON hosts BEGIN
+                DELETE FROM hosts_fts WHERE rowid = old.id;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS categories_fts_update AFTER UPDATE OF name ON categories BEGIN
+                UPDATE hosts_fts SET category_name = new.name
+                WHERE rowid IN (SELECT id FROM hosts WHERE category_id = new.id);
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS categories_fts_delete AFTER DELETE ON categories BEGIN
+                UPDATE hosts_fts SET category_name = NULL
+                WHERE rowid IN (SELECT id FROM hosts WHERE category_id = old.id);
+            END;
         ''')
         
-        # Create hosts table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS hosts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                url TEXT NOT NULL,
-                location TEXT,
-                notes TEXT,
-                status TEXT DEFAULT 'unknown',
-                last_checked DATETIME,
-                icon TEXT,
-                category_id INTEGER,
-                FOREIGN KEY (category_id) REFERENCES categories (id)
-            )
+        if not exists:
+            # Index the hosts that were added before search existed
+            conn.execute('''
+                INSERT INTO hosts_fts (rowid, name, url, location, notes, category_name)
+                SELECT h.id, h.name, h.url, h.location, h.notes, c.name
+                FROM hosts h
+                LEFT JOIN categories c ON h.category_id = c.id
+            ''')
+        self.fts_enabled = True
+    
+    def _init_icon_refs(self, conn):
+        """Create the icon reference counts, kept in sync with hosts.icon by triggers
+        
+        Icon files are shared between hosts, a file can be deleted once its
+        count drops to zero. FontAwesome icon names are not counted.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'icons'").fetchone()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS icons (
+                name TEXT PRIMARY KEY,
+                refs INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_icon_insert AFTER INSERT ON hosts
+            WHEN new.icon IS NOT NULL AND new.icon NOT LIKE 'fa-%' BEGIN
+                INSERT INTO icons (name, refs) VALUES (new.icon, 1)
+                ON CONFLICT (name) DO UPDATE SET refs = refs + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_icon_release AFTER UPDATE OF icon ON hosts
+            WHEN old.icon IS NOT new.icon AND old.icon IS NOT NULL AND old.icon NOT LIKE 'fa-%' BEGIN
+                UPDATE icons SET refs = refs - 1 WHERE name = old.icon;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_icon_acquire AFTER UPDATE OF icon ON hosts
+            WHEN old.icon IS NOT new.icon AND new.icon IS NOT NULL AND new.icon NOT LIKE 'fa-%' BEGIN
+                INSERT INTO icons (name, refs) VALUES (new.icon, 1)
+                ON CONFLICT (name) DO UPDATE SET refs = refs + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS hosts_icon_delete AFTER DELETE ON hosts
+            WHEN old.icon IS NOT NULL AND old.icon NOT LIKE 'fa-%' BEGIN
+                UPDATE icons SET refs = refs - 1 WHERE name = old.icon;
+            END;
         ''')
         
-        conn.commit()
-        conn.close()
-        print("Database initialized successfully")
+        if not exists:
+            # Count the icons of hosts saved before icons were shared
+            conn.execute('''
+                INSERT INTO icons (name, refs)
+                SELECT icon, COUNT(*) FROM hosts
+                WHERE icon IS NOT NULL AND icon NOT LIKE 'fa-%'
+                GROUP BY icon
+            ''')
+    
+    def _ensure_column(self, conn, table, column, definition):
+        """Add a column to an existing table if it is missing"""
+        columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            print(f"Added column {table}.{column}")
+    
+    def _next_version(self, conn):
+        """Bump the data version inside the caller's transaction and return it"""
+        conn.execute('UPDATE sync_state SET version = version + 1 WHERE id = 1')
+        return conn.execute('SELECT version FROM sync_state WHERE id = 1').fetchone()['version']
+    
+    def get_data_version(self):
+        """Get the current data version, which increases with every write"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT version FROM sync_state WHERE id = 1').fetchone()
+        return row['version'] if row else 0
     
     # Host operations
     def get_all_hosts(self):
         """Get all hosts from database"""
-        conn = self.get_connection()
-        hosts = conn.execute('''
-            SELECT h.*, c.name as category_name 
-            FROM hosts h 
-            LEFT JOIN categories c ON h.category_id = c.id
-            ORDER BY h.name
-        ''').fetchall()
-        conn.close()
+        with self.connection() as conn:
+            hosts = conn.execute('''
+                SELECT h.*, c.name as category_name
+                FROM hosts h
+                LEFT JOIN categories c ON h.category_id = c.id
+                ORDER BY h.name
+            ''').fetchall()
+        return [dict(host) for host in hosts]
+    
+    def get_category_summaries(self):
+        """Get every category that has hosts with its host count and data version
+        
+        Hosts without a (still existing) category are summarized under id 0
+        as 'Uncategorized'. Categories are ordered by name.
+        """
+        with self.connection() as conn:
+            categories = conn.execute('''
+                SELECT COALESCE(c.id, 0) AS id, COALESCE(c.name, 'Uncategorized') AS name,
+                       COUNT(*) AS hosts, MAX(MAX(h.version), COALESCE(c.version, 0)) AS version
+                FROM hosts h
+                LEFT JOIN categories c ON h.category_id = c.id
+                GROUP BY COALESCE(c.id, 0)
+                ORDER BY name
+            ''').fetchall()
+        return [dict(category) for category in categories]
+    
+    def get_category_hosts(self, category_id, limit, after=None):
+        """Get one page of the hosts of a category, ordered by name
+        
+        `after` is the (name, id) of the last host of the previous page.
+        Category id 0 returns the uncategorized hosts.
+        """
+        if category_id:
+            condition, params = 'h.category_id = ?', [category_id]
+        else:
+            condition, params = 'c.id IS NULL', []
+        if after:
+            condition += ' AND (h.name, h.id) > (?, ?)'
+            params += list(after)
+        
+        with self.connection() as conn:
+            hosts = conn.execute(f'''
+                SELECT h.*, c.name as category_name
+                FROM hosts h
+                LEFT JOIN categories c ON h.category_id = c.id
+                WHERE {condition}
+                ORDER BY h.name, h.id
+                LIMIT ?
+            ''', params + [limit]).fetchall()
         return [dict(host) for host in hosts]
     
+    def get_hosts_since(self, version):
+        """Get hosts changed and ids of hosts deleted after a data version"""
+        with self.connection() as conn:
+            hosts = conn.execute('''
+                SELECT h.*, c.name as category_name
+                FROM hosts h
+                LEFT JOIN categories c ON h.category_id = c.id
+                WHERE h.version > ?
+                ORDER BY h.name
+            ''', (version,)).fetchall()
+            deleted = conn.execute('''
+                SELECT item_id FROM tombstones WHERE kind = 'host' AND version > ?
+            ''', (version,)).fetchall()
+        return [dict(host) for host in hosts], [row['item_id'] for row in deleted]
+    
     def get_host_by_id(self, host_id):
         """Get a single host by ID"""
-        conn = self.get_connection()
-        host = conn.execute('SELECT * FROM hosts WHERE id = ?', (host_id,)).fetchone()
-        conn.close()
+        with self.connection() as conn:
+            host = conn.execute('SELECT * FROM hosts WHERE id = ?', (host_id,)).fetchone()
         return dict(host) if host else None
     
     def save_host(self, host_data, host_id=None):
         """Save or update a host"""
-        conn = self.get_connection()
-        
-        if host_id and host_id != 0:
-            # Update existing host
-            conn.execute('''
-                UPDATE hosts 
-                SET name=?, url=?, location=?, notes=?, category_id=?, icon=?
-                WHERE id=?
-            ''', (
-                host_data['name'], host_data['url'], host_data['location'], 
-                host_data['notes'], host_data.get('category_id'), 
-                host_data.get('icon'), host_id
-            ))
-        else:
-            # Insert new host
-            cursor = conn.execute('''
-                INSERT INTO hosts (name, url, location, notes, status, last_checked, icon, category_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                host_data['name'], host_data['url'], host_data['location'], 
-                host_data['notes'], host_data.get('status', 'unknown'), 
-                host_data.get('last_checked'), host_data.get('icon'),
-                host_data.get('category_id')
-            ))
-            host_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            if host_id and host_id != 0:
+                # Update existing host
+                # The resolved URL only stays valid while the URL is unchanged
+                conn.execute('''
+                    UPDATE hosts
+                    SET name=?, url=?, location=?, notes=?, category_id=?, icon=?, check_interval=?, version=?,
+                        probe_type=?,
+                        resolved_url = CASE WHEN url = ? THEN resolved_url END,
+                        resolved_scheme = CASE WHEN url = ? THEN resolved_scheme END
+                    WHERE id=?
+                ''', (
+                    host_data['name'], host_data['url'], host_data['location'],
+                    host_data['notes'], host_data.get('category_id'),
+                    host_data.get('icon'), host_data.get('check_interval'), version,
+                    host_data.get('probe_type', 'http'),
+                    host_data['url'], host_data['url'], host_id
+                ))
+            else:
+                # Insert new host
+                cursor = conn.execute('''
+                    INSERT INTO hosts (name, url, location, notes, status, last_checked, icon, category_id, check_interval,
+                                       version, probe_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    host_data['name'], host_data['url'], host_data['location'],
+                    host_data['notes'], host_data.get('status', 'unknown'),
+                    host_data.get('last_checked'), host_data.get('icon'),
+                    host_data.get('category_id'), host_data.get('check_interval'), version,
+                    host_data.get('probe_type', 'http')
+                ))
+                host_id = cursor.lastrowid
+            
+            conn.commit()
         return host_id
     
+    def set_host_icon(self, host_id, icon):
+        """Point a host at a different icon file"""
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            conn.execute('UPDATE hosts SET icon=?, version=? WHERE id=?', (icon, version, host_id))
+            conn.commit()
+    
+    def get_icon_names(self):
+        """Get the file names of all icons in use"""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT name FROM icons WHERE refs > 0 ORDER BY name').fetchall()
+        return [row['name'] for row in rows]
+    
+    def take_unused_icons(self, remove=None):
+        """Forget the icons no host refers to anymore and return their names
+        
+        remove(name) is called for each icon before the transaction commits,
+        so the files are gone before any other process can take a new
+        reference to the same icon.
+        """
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # The write lock keeps the selected rows unchanged until they are deleted,
+            # DELETE ... RETURNING would need SQLite 3.35
+            names = [row['name'] for row in conn.execute('SELECT name FROM icons WHERE refs <= 0').fetchall()]
+            conn.execute('DELETE FROM icons WHERE refs <= 0')
+            if remove:
+                for name in names:
+                    remove(name)
+            conn.commit()
+        return names
+    
     def delete_host(self, host_id):
         """Delete a host"""
-        conn = self.get_connection()
-        conn.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            conn.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
+            conn.execute('INSERT OR REPLACE INTO tombstones (kind, item_id, version) VALUES (?, ?, ?)',
+                         ('host', host_id, version))
+            conn.execute('DELETE FROM check_results WHERE host_id = ?', (host_id,))
+            conn.execute('DELETE FROM check_rollups WHERE host_id = ?', (host_id,))
+            conn.commit()
     
     def update_host_status(self, host_id, status, last_checked):
         """Update host status and last checked time"""
-        conn = self.get_connection()
-        conn.execute('''
-            UPDATE hosts 
-            SET status=?, last_checked=?
-            WHERE id=?
-        ''', (status, last_checked, host_id))
-        conn.commit()
-        conn.close()
+        self.update_host_statuses([{'id': host_id, 'status': status, 'last_checked': last_checked}])
+    
+    def update_host_statuses(self, results):
+        """Apply a batch of check results in a single transaction
+        
+        `results` is an iterable of dicts with 'id', 'status' and 'last_checked',
+        and optionally 'checked_at' (epoch seconds), the 'latency_ms',
+        'connect_ms' and 'ttfb_ms' timings, and for online probes the
+        'resolved_url', 'resolved_scheme', rolling 'latency_p50/p95/p99' and
+        the 'latency_state' they were computed from. Every result is also
+        appended to the check history.
+        """
+        results = list(results)
+        if not results:
+            return
+        
+        history = []
+        for result in results:
+            checked_at = result.get('checked_at')
+            if checked_at is None:
+                checked_at = int(datetime.strptime(result['last_checked'], '%Y-%m-%d %H:%M:%S').timestamp())
+            history.append((result['id'], checked_at, 1 if result['status'] == 'online' else 0,
+                            result.get('latency_ms')))
+        
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            conn.executemany('''
+                UPDATE hosts
+                SET status=?, last_checked=?, version=?,
+                    resolved_url = COALESCE(?, resolved_url),
+                    resolved_scheme = COALESCE(?, resolved_scheme),
+                    latency_ms=?, connect_ms=?, ttfb_ms=?,
+                    latency_p50 = COALESCE(?, latency_p50),
+                    latency_p95 = COALESCE(?, latency_p95),
+                    latency_p99 = COALESCE(?, latency_p99),
+                    latency_state = COALESCE(?, latency_state)
+                WHERE id=?
+            ''', [(result['status'], result['last_checked'], version,
+                   result.get('resolved_url'), result.get('resolved_scheme'),
+                   result.get('latency_ms'), result.get('connect_ms'), result.get('ttfb_ms'),
+                   result.get('latency_p50'), result.get('latency_p95'), result.get('latency_p99'),
+                   result.get('latency_state'), result['id'])
+                  for result in results])
+            conn.executemany('''
+                INSERT OR REPLACE INTO check_results (host_id, checked_at, status, latency_ms)
+                VALUES (?, ?, ?, ?)
+            ''', history)
+            conn.commit()
+    
+    # Lease operations
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew a named lease for `ttl` seconds
+        
+        Succeeds when the lease is free, expired or already held by `owner`.
+        Returns whether `owner` holds the lease afterwards.
+        """
+        now = datetime.now().timestamp()
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            ''', (name, owner, now + ttl, now))
+            conn.commit()
+            row = conn.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()
+        return row is not None and row['owner'] == owner
+    
+    def release_lease(self, name, owner):
+        """Give up a lease if `owner` holds it"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+            conn.commit()
+    
+    # Check history operations
+    def compact_history(self, raw_days=7, hourly_days=90, daily_days=730, now=None):
+        """Downsample old check history and drop what is past retention
+        
+        Raw results older than `raw_days` are folded into hourly rollups,
+        hourly rollups older than `hourly_days` into daily rollups, and daily
+        rollups older than `daily_days` are deleted. Only whole buckets are
+        folded, so rerunning this never counts a check twice.
+        """
+        now = int(now if now is not None else datetime.now().timestamp())
+        raw_cutoff = (now - raw_days * DAILY) // HOURLY * HOURLY
+        hourly_cutoff = (now - hourly_days * DAILY) // DAILY * DAILY
+        daily_cutoff = now - daily_days * DAILY
+        
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO check_rollups (host_id, resolution, bucket, checks, online, latency_sum, latency_max)
+                SELECT host_id, ?, checked_at / ? * ?, COUNT(*), SUM(status),
+                       COALESCE(SUM(latency_ms), 0), MAX(latency_ms)
+                FROM check_results
+                WHERE checked_at < ?
+                GROUP BY host_id, checked_at / ?
+                ON CONFLICT (host_id, resolution, bucket) DO UPDATE SET
+                    checks = checks + excluded.checks,
+                    online = online + excluded.online,
+                    latency_sum = latency_sum + excluded.latency_sum,
+                    latency_max = MAX(COALESCE(latency_max, 0), COALESCE(excluded.latency_max, 0))
+            ''', (HOURLY, HOURLY, HOURLY, raw_cutoff, HOURLY))
+            raw_deleted = conn.execute('DELETE FROM check_results WHERE checked_at < ?', (raw_cutoff,)).rowcount
+            
+            conn.execute('''
+                INSERT INTO check_rollups (host_id, resolution, bucket, checks, online, latency_sum, latency_max)
+                SELECT host_id, ?, bucket / ? * ?, SUM(checks), SUM(online), SUM(latency_sum), MAX(latency_max)
+                FROM check_rollups
+                WHERE resolution = ? AND bucket < ?
+                GROUP BY host_id, bucket / ?
+                ON CONFLICT (host_id, resolution, bucket) DO UPDATE SET
+                    checks = checks + excluded.checks,
+                    online = online + excluded.online,
+                    latency_sum = latency_sum + excluded.latency_sum,
+                    latency_max = MAX(COALESCE(latency_max, 0), COALESCE(excluded.latency_max, 0))
+            ''', (DAILY, DAILY, DAILY, HOURLY, hourly_cutoff, DAILY))
+            hourly_deleted = conn.execute('DELETE FROM check_rollups WHERE resolution = ? AND bucket < ?',
+                                          (HOURLY, hourly_cutoff)).rowcount
+            
+            daily_deleted = conn.execute('DELETE FROM check_rollups WHERE resolution = ? AND bucket < ?',
+                                         (DAILY, daily_cutoff)).rowcount
+            conn.commit()
+        
+        return {'raw': raw_deleted, 'hourly': hourly_deleted, 'daily': daily_deleted}
+    
+    def get_uptime(self, host_id, start, end):
+        """Get the uptime percentage of a host between two epoch timestamps
+        
+        Combines raw results with the rollups they were folded into, so the
+        result covers the whole retention period. Returns None without data.
+        """
+        with self.connection() as conn:
+            raw = conn.execute('''
+                SELECT COUNT(*) AS checks, COALESCE(SUM(status), 0) AS online
+                FROM check_results
+                WHERE host_id = ? AND checked_at >= ? AND checked_at < ?
+            ''', (host_id, start, end)).fetchone()
+            rolled = conn.execute('''
+                SELECT COALESCE(SUM(checks), 0) AS checks, COALESCE(SUM(online), 0) AS online
+                FROM check_rollups
+                WHERE host_id = ? AND resolution IN (?, ?) AND bucket >= ? AND bucket < ?
+            ''', (host_id, HOURLY, DAILY, start, end)).fetchone()
+        
+        checks = raw['checks'] + rolled['checks']
+        if not checks:
+            return None
+        return 100.0 * (raw['online'] + rolled['online']) / checks
+    
+    def get_outages(self, host_id, start, end):
+        """Get the outage windows of a host between two epoch timestamps
+        
+        Windows from raw results are exact to the check. Older windows come
+        from rollup buckets that saw any offline check, merged when adjacent,
+        and carry the bucket size in 'resolution'. A window still ongoing at
+        `end` has 'end' set to None.
+        """
+        with self.connection() as conn:
+            # Only the checks where the status flipped are returned
+            changes = conn.execute('''
+                SELECT checked_at, status FROM (
+                    SELECT checked_at, status,
+                           LAG(status) OVER (ORDER BY checked_at) AS previous
+                    FROM check_results
+                    WHERE host_id = ? AND checked_at >= ? AND checked_at < ?
+                )
+                WHERE previous IS NULL OR status != previous
+                ORDER BY checked_at
+            ''', (host_id, start, end)).fetchall()
+            buckets = conn.execute('''
+                SELECT resolution, bucket FROM check_rollups
+                WHERE host_id = ? AND resolution IN (?, ?) AND bucket >= ? AND bucket < ?
+                  AND online < checks
+                ORDER BY bucket
+            ''', (host_id, HOURLY, DAILY, start, end)).fetchall()
+        
+        outages = []
+        for row in buckets:
+            bucket_end = row['bucket'] + row['resolution']
+            last = outages[-1] if outages else None
+            if last and last['end'] == row['bucket']:
+                last['end'] = bucket_end
+                last['resolution'] = max(last['resolution'], row['resolution'])
+            else:
+                outages.append({'start': row['bucket'], 'end': bucket_end, 'resolution': row['resolution']})
+        
+        current = None
+        for row in changes:
+            if row['status'] == 0:
+                current = {'start': row['checked_at'], 'end': None, 'resolution': 0}
+                outages.append(current)
+            elif current:
+                current['end'] = row['checked_at']
+                current = None
+        
+        for outage in outages:
+            outage['duration'] = (outage['end'] or end) - outage['start']
+        return outages
+    
+    def search_hosts(self, query, limit=50):
+        """Search hosts by name, URL, location, notes and category name
+        
+        Every word of the query must match the start of a word in the host,
+        and results are ranked with name matches first.
+        """
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        
+        with self.connection() as conn:
+            if self.fts_enabled:
+                match = ' '.join(f'"{term}"*' for term in terms)
+                hosts = conn.execute('''
+                    SELECT h.*, c.name as category_name
+                    FROM hosts_fts f
+                    JOIN hosts h ON h.id = f.rowid
+                    LEFT JOIN categories c ON h.category_id = c.id
+                    WHERE hosts_fts MATCH ?
+                    ORDER BY bm25(hosts_fts, 10.0, 4.0, 2.0, 1.0, 2.0), h.name
+                    LIMIT ?
+                ''', (match, limit)).fetchall()
+            else:
+                conditions = []
+                params = []
+                for term in terms:
+                    conditions.append('''(h.name LIKE ? OR h.url LIKE ? OR h.location LIKE ?
+                                          OR h.notes LIKE ? OR c.name LIKE ?)''')
+                    params += [f'%{term}%'] * 5
+                hosts = conn.execute(f'''
+                    SELECT h.*, c.name as category_name
+                    FROM hosts h
+                    LEFT JOIN categories c ON h.category_id = c.id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY h.name
+                    LIMIT ?
+                ''', params + [limit]).fetchall()
+        return [dict(host) for host in hosts]
+    
+    def get_counts(self):
+        """Get the number of hosts and categories without loading them"""
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT (SELECT COUNT(*) FROM hosts) AS hosts,
+                       (SELECT COUNT(*) FROM categories) AS categories
+            ''').fetchone()
+        return dict(row)
     
     def get_unique_locations(self):
         """Get all unique locations from hosts"""
-        conn = self.get_connection()
-        locations = conn.execute('''
-            SELECT DISTINCT location 
-            FROM hosts 
-            WHERE location IS NOT NULL AND location != ''
-            ORDER BY location
-        ''').fetchall()
-        conn.close()
+        with self.connection() as conn:
+            locations = conn.execute('''
+                SELECT DISTINCT location
+                FROM hosts
+                WHERE location IS NOT NULL AND location != ''
+                ORDER BY location
+            ''').fetchall()
         return [row['location'] for row in locations]
     
     # Category operations
     def get_all_categories(self):
         """Get all categories from database"""
-        conn = self.get_connection()
-        categories = conn.execute('SELECT * FROM categories ORDER BY name').fetchall()
-        conn.close()
+        with self.connection() as conn:
+            categories = conn.execute('SELECT * FROM categories ORDER BY name').fetchall()
         return [dict(cat) for cat in categories]
     
+    def get_categories_since(self, version):
+        """Get categories changed and ids of categories deleted after a data version"""
+        with self.connection() as conn:
+            categories = conn.execute('SELECT * FROM categories WHERE version > ? ORDER BY name',
+                                      (version,)).fetchall()
+            deleted = conn.execute('''
+                SELECT item_id FROM tombstones WHERE kind = 'category' AND version > ?
+            ''', (version,)).fetchall()
+        return [dict(cat) for cat in categories], [row['item_id'] for row in deleted]
+    
     def get_category_by_id(self, category_id):
         """Get a single category by ID"""
-        conn = self.get_connection()
-        category = conn.execute('SELECT * FROM categories WHERE id = ?', (category_id,)).fetchone()
-        conn.close()
+        with self.connection() as conn:
+            category = conn.execute('SELECT * FROM categories WHERE id = ?', (category_id,)).fetchone()
         return dict(category) if category else None
     
     def save_category(self, category_data, category_id=None):
         """Save or update a category"""
-        conn = self.get_connection()
-        
-        if category_id and category_id != 0:
-            # Update existing category
-            conn.execute('''
-                UPDATE categories 
-                SET name=?, description=?
-                WHERE id=?
-            ''', (category_data['name'], category_data['description'], category_id))
-        else:
-            # Insert new category
-            cursor = conn.execute('''
-                INSERT INTO categories (name, description)
-                VALUES (?, ?)
-            ''', (category_data['name'], category_data['description']))
-            category_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            if category_id and category_id != 0:
+                # Update existing category
+                conn.execute('''
+                    UPDATE categories
+                    SET name=?, description=?, version=?
+                    WHERE id=?
+                ''', (category_data['name'], category_data['description'], version, category_id))
+                # Hosts carry the category name, so they changed too
+                conn.execute('UPDATE hosts SET version=? WHERE category_id=?', (version, category_id))
+            else:
+                # Insert new category
+                cursor = conn.execute('''
+                    INSERT INTO categories (name, description, version)
+                    VALUES (?, ?, ?)
+                ''', (category_data['name'], category_data['description'], version))
+                category_id = cursor.lastrowid
+            
+            conn.commit()
         return category_id
     
     def delete_category(self, category_id):
         """Delete a category"""
-        conn = self.get_connection()
-        conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            version = self._next_version(conn)
+            conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+            conn.execute('INSERT OR REPLACE INTO tombstones (kind, item_id, version) VALUES (?, ?, ?)',
+                         ('category', category_id, version))
+            conn.execute('UPDATE hosts SET version=? WHERE category_id=?', (version, category_id))
+            conn.commit()
+
+
+class CachedDashboardDatabase(DashboardDatabase):
+    """DashboardDatabase that serves host and category listings from memory
+    
+    Listings are dropped after every write made through this instance, and
+    after other connections or processes bump the data version in sync_state.
+    That includes status batches, which change the host rows clients sync, so
+    while hosts are being checked listings are reloaded after every batch.
+    PRAGMA data_version would also change on lease renewals and history
+    compaction, which leave the listings as they are.
+    """
+    
+    def __init__(self, db_file, settings=None):
+        super().__init__(db_file, settings)
+        self._cache = {}
+        self._generation = 0
+        self._cache_lock = threading.Lock()
+        self._version_conn = None
+        self._data_version = None
+    
+    def invalidate(self):
+        """Drop all cached listings"""
+        with self._cache_lock:
+            self._cache.clear()
+            self._generation += 1
+    
+    def _check_data_version(self):
+        with self._cache_lock:
+            if self._version_conn is None:
+                self._version_conn = self.get_connection()
+            version = self._version_conn.execute('SELECT version FROM sync_state WHERE id = 1').fetchone()[0]
+            if version != self._data_version:
+                self._data_version = version
+                self._cache.clear()
+                self._generation += 1
+    
+    def _cached(self, key, loader):
+        self._check_data_version()
+        with self._cache_lock:
+            rows = self._cache.get(key)
+            generation = self._generation
+        
+        if rows is None:
+            rows = loader()
+            with self._cache_lock:
+                # Don't store a listing that an invalidation has overtaken
+                if generation == self._generation:
+                    self._cache[key] = rows
+        
+        # Callers are free to modify the returned dicts
+        return [dict(row) for row in rows]
+    
+    def close(self):
+        """Close all idle pooled connections and the version connection"""
+        super().close()
+        with self._cache_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+    
+    def get_all_hosts(self):
+        """Get all hosts, from memory when unchanged"""
+        return self._cached('hosts', super().get_all_hosts)
+    
+    def get_all_categories(self):
+        """Get all categories, from memory when unchanged"""
+        return self._cached('categories', super().get_all_categories)
+    
+    def get_category_summaries(self):
+        """Get category summaries, from memory when unchanged"""
+        return self._cached('category_summaries', super().get_category_summaries)
+    
+    def save_host(self, host_data, host_id=None):
+        host_id = super().save_host(host_data, host_id)
+        self.invalidate()
+        return host_id
+    
+    def set_host_icon(self, host_id, icon):
+        super().set_host_icon(host_id, icon)
+        self.invalidate()
+    
+    def delete_host(self, host_id):
+        super().delete_host(host_id)
+        self.invalidate()
+    
+    def update_host_statuses(self, results):
+        super().update_host_statuses(results)
+        self.invalidate()
+    
+    def save_category(self, category_data, category_id=None):
+        category_id = super().save_category(category_data, category_id)
+        self.invalidate()
+        return category_id
+    
+    def delete_category(self, category_id):
+        super().delete_category(category_id)
+        self.invalidate()
 
 
 # Factory function to create database instance
-def create_database_instance(db_file):
-    """Factory function to create a DashboardDatabase instance"""
-    return DashboardDatabase(db_file)
+def create_database_instance(db_file, settings=None):
+    """Factory function to create a DashboardDatabase instance
+    
+    Returns the cached variant unless `cache` is disabled in the settings.
+    """
+    if (settings or {}).get('cache', True):
+        return CachedDashboardDatabase(db_file, settings)
+    return DashboardDatabase(db_file, settings)
@@ -0,0 +1,277 @@
+"""
+Icon processing module for the dashboard application.
+Resizes, strips and re-encodes uploaded raster icons, keeping a 2x variant
+for HiDPI screens, and sanitizes and minifies SVG icons.
+
+Icons are stored under a hash of their content, so hosts with the same icon
+share one file. Raster processing needs Pillow. Without it raster icons are
+stored as uploaded.
+"""
+
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+from assets import Asset
+
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+# Suffix of the double resolution variant of a raster icon
+HIDPI_SUFFIX = '@2x'
+
+# SVG elements that can run code, embed other documents or only carry editor data
+UNSAFE_SVG_ELEMENTS = {'script', 'foreignObject', 'iframe', 'embed', 'object', 'metadata'}
+
+# Encoders for the supported output formats
+RASTER_FORMATS = {
+    'webp': ('WEBP', {'quality': 90, 'method': 6}),
+    'png': ('PNG', {'optimize': True})
+}
+
+# Icons larger than this are linked from the icon bundle instead of inlined
+MAX_INLINE_BYTES = 16384
+
+# Pillow, once imported by load_pillow(), False when it is not installed
+_pillow = None
+
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+mimetypes.add_type('image/webp', '.webp')
+
+
+class IconError(ValueError):
+    """Raised for uploads that are not a usable image"""
+
+
+def load_pillow():
+    """Import Pillow on first use, returns its Image module or None when not installed"""
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image
+            _pillow = Image
+        except ImportError:
+            _pillow = False
+    return _pillow or None
+
+
+def hidpi_name(fname):
+    """Get the file name of the 2x variant of an icon"""
+    base, extension = os.path.splitext(fname)
+    return base + HIDPI_SUFFIX + extension
+
+
+def process_icon(data, extension, size=64, image_format='webp'):
+    """Process an uploaded icon
+
+    Returns the extension to store the icon with and a dict of variants,
+    mapping the file name suffix ('' or '@2x') to the encoded bytes.
+    Raises IconError when the data can't be read as an image.
+    """
+    extension = extension.lower()
+    if extension == '.svg':
+        return '.svg', {'': sanitize_svg(data)}
+
+    if load_pillow() is None:
+        print('Warning: Pillow is not installed, storing icon as uploaded')
+        return extension, {'': data}
+    return resize_raster(data, size, image_format)
+
+
+def resize_raster(data, size, image_format='webp'):
+    """Scale a raster image to fit `size` and twice that, dropping all metadata
+
+    Images are never scaled up, and the 2x variant is left out when the
+    source isn't larger than `size`. Animated images keep their first frame.
+    """
+    from PIL import Image, ImageOps, features
+
+    if image_format not in RASTER_FORMATS or (image_format == 'webp' and not features.check('webp')):
+        image_format = 'png'
+    encoder, options = RASTER_FORMATS[image_format]
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source.seek(0)
+            # Apply the EXIF orientation before the EXIF data is dropped
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise IconError(f'Unreadable image: {e}')
+
+    variants = {}
+    for suffix, scale in (('', 1), (HIDPI_SUFFIX, 2)):
+        if scale > 1 and max(image.size) <= size:
+            break
+        scaled = image.copy()
+        scaled.thumbnail((size * scale, size * scale), Image.LANCZOS)
+        # Only pixel data is written, no EXIF, ICC profile or comments
+        output = io.BytesIO()
+        scaled.save(output, encoder, **options)
+        variants[suffix] = output.getvalue()
+
+    return '.' + image_format, variants
+
+
+def sanitize_svg(data):
+    """Remove scripts, event handlers, external references and editor data from an SVG
+
+    Returns the cleaned document without comments and indentation.
+    """
+    text = data.decode('utf-8', errors='replace') if isinstance(data, bytes) else data
+    # Entities allow expansion bombs and external file references
+    if re.search(r'<!(DOCTYPE|ENTITY)', text, re.IGNORECASE):
+        raise IconError('SVG documents with a DOCTYPE are not accepted')
+
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError as e:
+        raise IconError(f'Invalid SVG: {e}')
+    if root.tag not in (f'{{{SVG_NS}}}svg', 'svg'):
+        raise IconError('Not an SVG document')
+    if root.tag == 'svg':
+        root.set('xmlns', SVG_NS)
+
+    _clean_svg_element(root)
+    return ET.tostring(root, encoding='utf-8')
+
+
+def _local_name(tag):
+    namespace, _, name = tag.rpartition('}')
+    return namespace.lstrip('{'), name
+
+
+def _clean_svg_element(element):
+    for child in list(element):
+        namespace, name = _local_name(child.tag) if isinstance(child.tag, str) else (None, None)
+        # Comments, processing instructions and other applications' elements go too
+        if name is None or namespace not in (SVG_NS, '') or name in UNSAFE_SVG_ELEMENTS:
+            element.remove(child)
+            continue
+        if name == 'style' and re.search(r'@import|url\(\s*[\'"]?(?!#)|javascript:', child.text or '', re.IGNORECASE):
+            element.remove(child)
+            continue
+        _clean_svg_element(child)
+
+    for attribute, value in list(element.attrib.items()):
+        namespace, name = _local_name(attribute)
+        if namespace not in ('', XLINK_NS, XML_NS) or name.lower().startswith('on'):
+            del element.attrib[attribute]
+        elif name == 'href' and not value.strip().startswith(('#', 'data:image/')):
+            del element.attrib[attribute]
+        elif re.search(r'url\(\s*[\'"]?(?!#)|javascript:|expression\(', value, re.IGNORECASE):
+            del element.attrib[attribute]
+
+    # Indentation between elements is not content
+    if element.text and not element.text.strip():
+        element.text = None
+    if element.tail and not element.tail.strip():
+        element.tail = None
+
+
+def store_icon(folder, extension, variants):
+    """Store the variants of a processed icon under a hash of their content
+
+    Identical icons share one file, and a file name never changes content,
+    so it can be cached forever. Returns the file name of the 1x icon.
+    """
+    digest = hashlib.sha256()
+    for suffix in sorted(variants):
+        digest.update(variants[suffix])
+    basename = digest.hexdigest()[:32]
+
+    for suffix, data in variants.items():
+        path = os.path.join(folder, basename + suffix + extension)
+        if os.path.exists(path):
+            continue
+        # Readers never see a partly written file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return basename + extension
+
+
+def remove_icon(folder, fname):
+    """Delete an icon file and its 2x variant, if any"""
+    for name in (fname, hidpi_name(fname)):
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
+
+
+def icon_class(fname):
+    """Get the CSS class of an icon in the icon bundle"""
+    return 'icon-' + re.sub(r'[^A-Za-z0-9_-]', '_', os.path.splitext(fname)[0])
+
+
+class IconBundle:
+    """One stylesheet with every stored icon inlined as a data URI
+
+    The rule of each icon is kept between builds, so when the set of
+    icons changes only the added icons are read and encoded.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.digest = None
+        self.asset = None
+        self._rules = {}
+        self._lock = threading.Lock()
+
+    def update(self, names):
+        """Bring the bundle up to date with a set of icon file names
+
+        Returns the bundle as a precompressed Asset.
+        """
+        names = sorted(names)
+        digest = hashlib.sha256('\n'.join(names).encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            # Icon files never change content, so the same names give the same bundle
+            if digest == self.digest:
+                return self.asset
+
+            rules = {}
+            for name in names:
+                rule = self._rules.get(name)
+                if rule is None:
+                    rule = self._rule(name)
+                if rule:
+                    rules[name] = rule
+
+            self._rules = rules
+            css = ''.join(rules[name] for name in names if name in rules).encode('utf-8')
+            self.asset = Asset('icons.css', css)
+            self.digest = digest
+            return self.asset
+
+    def _url(self, fname):
+        path = os.path.join(self.folder, fname)
+        if os.path.getsize(path) > MAX_INLINE_BYTES:
+            return '/img/' + fname
+        with open(path, 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        mimetype = mimetypes.guess_type(fname)[0] or 'application/octet-stream'
+        return f'data:{mimetype};base64,{data}'
+
+    def _rule(self, name):
+        try:
+            url = self._url(name)
+            hidpi = self._url(hidpi_name(name)) if os.path.exists(os.path.join(self.folder, hidpi_name(name))) else None
+        except OSError as e:
+            print(f'Warning: Leaving icon {name} out of the icon bundle: {e}')
+            return None
+
+        rule = f'.{icon_class(name)}{{background-image:url("{url}")'
+        if hidpi:
+            rule += f';background-image:image-set(url("{url}") 1x,url("{hidpi}") 2x)'
+        return rule + '}\n'
@@ -0,0 +1,320 @@
+"""
+Metrics module for the dashboard application.
+Counters, gauges and histograms rendered in the Prometheus text format.
+
+Every thread updates its own copy of the values without taking a lock.
+A scrape adds up the copies of all threads, and the values of a thread
+that has finished are folded into a shared total when it exits, so
+per-request threads don't leave anything behind.
+
+Processes that share() a directory write their values to a file there
+every few seconds, and a scrape adds up the files of all processes, so
+the production workers and the standalone checker report one total.
+"""
+
+import atexit
+import bisect
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+
+
+# Request and query durations in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Probe durations in seconds, up to the usual host deadlines
+PROBE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_local = threading.local()
+_lock = threading.Lock()
+_shard_ids = itertools.count()
+_live = {}      # shard id -> values of a running thread
+_retired = {}   # values of finished threads
+_metrics = []   # all metrics, in the order they were defined
+_finalizers = {}
+
+# Directory shared with the other processes and this process's file in it
+_shared_dir = None
+_shared_file = None
+_flusher_pid = None
+
+
+class _Shard:
+    """Owned by one thread, garbage collected when the thread exits"""
+
+
+def _thread_values():
+    try:
+        return _local.values
+    except AttributeError:
+        pass
+
+    values = {}
+    shard = _Shard()
+    shard_id = next(_shard_ids)
+    with _lock:
+        _live[shard_id] = values
+    _finalizers[shard_id] = weakref.finalize(shard, _retire, shard_id, values)
+    _local.shard = shard
+    _local.values = values
+    return values
+
+
+def _merge(total, values):
+    for key, value in values.items():
+        current = total.get(key)
+        if current is None:
+            total[key] = list(value)
+        else:
+            for i, item in enumerate(value):
+                current[i] += item
+
+
+def _retire(shard_id, values):
+    with _lock:
+        _live.pop(shard_id, None)
+        _finalizers.pop(shard_id, None)
+        _merge(_retired, values)
+
+
+def _reset_after_fork():
+    """Start a forked child from zero, the values so far belong to the parent"""
+    global _local, _lock, _live, _retired, _finalizers, _shared_file
+    for finalizer in _finalizers.values():
+        finalizer.detach()
+    _local = threading.local()
+    _lock = threading.Lock()
+    _live = {}
+    _retired = {}
+    _finalizers = {}
+    _shared_file = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def snapshot():
+    """Add up the values of all threads, keyed by metric name and label values"""
+    with _lock:
+        total = {key: list(value) for key, value in _retired.items()}
+        for values in list(_live.values()):
+            # Copying is atomic, the owning thread may be adding keys meanwhile
+            _merge(total, values.copy())
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _metrics.append(self)
+
+    def _slot(self, label_values, size):
+        values = _thread_values()
+        key = (self.name, label_values)
+        slot = values.get(key)
+        if slot is None:
+            slot = values[key] = [0] * size
+        return slot
+
+    def render(self, total):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for (name, label_values), value in sorted(total.items(), key=lambda item: item[0]):
+            if name == self.name:
+                lines.extend(self._samples(label_values, value))
+        return lines
+
+    def _samples(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.labels, label_values)} {_format_number(value[0])}']
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self._slot(label_values, 1)[0] += amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, like the number of running probes
+
+    Each thread must undo its own increments, which holds for anything
+    that is counted while it runs.
+    """
+
+    type = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        self._slot(label_values, 1)[0] += amount
+
+    def dec(self, *label_values, amount=1):
+        self._slot(label_values, 1)[0] -= amount
+
+
+class Histogram(Metric):
+    """Observations counted in buckets, with their count and sum"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        # One count per bucket plus +Inf, then the sum and the count
+        slot = self._slot(label_values, len(self.buckets) + 3)
+        slot[bisect.bisect_left(self.buckets, value)] += 1
+        slot[-2] += value
+        slot[-1] += 1
+
+    def _samples(self, label_values, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value):
+            cumulative += count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else _format_number(float(bound)))
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}')
+        labels = _format_labels(self.labels, label_values)
+        lines.append(f'{self.name}_sum{labels} {_format_number(value[-2])}')
+        lines.append(f'{self.name}_count{labels} {value[-1]}')
+        return lines
+
+
+def timed_methods(histogram, exclude=()):
+    """Class decorator observing the duration of every public method in a histogram
+
+    The histogram takes the method name as its only label.
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not callable(method):
+                continue
+            setattr(cls, name, _timed(histogram, name, method))
+        return cls
+    return decorate
+
+
+def _timed(histogram, name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def clear_shared(directory):
+    """Remove the values left by earlier runs from a shared directory"""
+    if not os.path.isdir(directory):
+        return
+    for fname in os.listdir(directory):
+        if fname.endswith('.json'):
+            os.remove(os.path.join(directory, fname))
+
+
+def share(directory, interval=5):
+    """Write the values of this process to `directory` every `interval` seconds
+
+    Files are named after the process ID plus a random part, so a reused
+    process ID never overwrites the final values of a process that exited.
+    """
+    global _shared_dir, _shared_file, _flusher_pid
+    os.makedirs(directory, exist_ok=True)
+    _shared_dir = directory
+    if _shared_file is None:
+        _shared_file = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+    if _flusher_pid == os.getpid():
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    _flusher_pid = os.getpid()
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+    atexit.register(flush)
+
+
+def flush():
+    """Write the values of this process to its file in the shared directory"""
+    if _shared_file is None:
+        return
+    values = [[name, list(labels), value] for (name, labels), value in snapshot().items()]
+    temp_file = _shared_file + '.tmp'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(values, f)
+        os.replace(temp_file, _shared_file)
+    except OSError as e:
+        print(f'Warning: Could not write metrics to {_shared_file}: {e}')
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shared_values(total):
+    """Add the values the other processes wrote to the shared directory"""
+    gauges = {metric.name for metric in _metrics if metric.type == 'gauge'}
+    for fname in os.listdir(_shared_dir):
+        path = os.path.join(_shared_dir, fname)
+        if not fname.endswith('.json') or path == _shared_file:
+            continue
+        try:
+            with open(path) as f:
+                values = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # Counters of exited processes still count, their gauges are stale
+        alive = _process_alive(int(fname.split('-', 1)[0]))
+        _merge(total, {(name, tuple(labels)): value for name, labels, value in values
+                       if alive or name not in gauges})
+
+
+def render():
+    """Get all metrics in the Prometheus text exposition format"""
+    total = snapshot()
+    if _shared_dir:
+        _shared_values(total)
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render(total))
+    return '\n'.join(lines) + '\n'
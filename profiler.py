@@ -0,0 +1,101 @@
+"""
+Profiling module for the dashboard application.
+Records where one thread spends its time, as folded stacks that flame
+graph tools (flamegraph.pl, speedscope, inferno) read directly.
+
+A background thread samples the stack of the profiled thread every few
+milliseconds, so the profiled code runs at its normal speed, and calls
+much shorter than the interval only show up when they add up.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+def _frame_label(code, roots):
+    filename = code.co_filename
+    for root in roots:
+        if filename.startswith(root):
+            filename = filename[len(root):].lstrip(os.sep)
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackProfiler:
+    """Samples the calling thread and sums the time spent in each distinct stack
+
+    Each sample is weighted by the time since the previous one, so the
+    samples of a stack add up to the time spent in its innermost function.
+    Only the frames entered after start() are recorded, below `root`.
+    """
+
+    def __init__(self, root='request', interval=0.001):
+        self.root = root.replace(';', ':')
+        self.interval = interval
+        self.stacks = defaultdict(float)
+        self.elapsed = 0.0
+        self._labels = {}
+        # Longest paths first, so files are named relative to the closest one
+        self._roots = sorted({os.path.abspath(path) for path in sys.path if path}, key=len, reverse=True)
+        self._thread_id = None
+        self._outer = {}
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._start = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        # The frames the thread is in now, kept alive so their ids stay unique
+        frame = sys._getframe(1)
+        while frame is not None:
+            self._outer[id(frame)] = frame
+            frame = frame.f_back
+        self._start = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        self.elapsed = time.perf_counter() - self._start
+        self._outer.clear()
+        return self
+
+    def _run(self):
+        last = self._start
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.stacks[self._stack(frame)] += now - last
+            last = now
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None and id(frame) not in self._outer:
+            label = self._labels.get(frame.f_code)
+            if label is None:
+                label = self._labels[frame.f_code] = _frame_label(frame.f_code, self._roots).replace(';', ':')
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(self.root)
+        return ';'.join(reversed(labels))
+
+    def folded(self):
+        """Get the profile as folded stack lines, weighted in microseconds"""
+        lines = []
+        for stack, seconds in sorted(self.stacks.items()):
+            microseconds = int(seconds * 1000000)
+            if microseconds:
+                lines.append(f'{stack} {microseconds}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the folded stacks to a file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.folded())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Benchmark the dashboard against synthetic inventories and local stub targets
+Generates a database of each size, serves its hosts from stub HTTP and TCP
+targets on 127.0.0.1 and measures page render times, the Check All sweep and
+peak memory use. Every size runs in its own process so peak RSS is per size.
+Usage: python3 benchmark.py [--sizes 100,1000,10000,50000] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The dashboard modules live one directory up
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Bumped when the layout of the results changes
+RESULTS_FORMAT = 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers /ok with 200, /error with 500 and never answers /hang"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        server = self.server
+        if self.path == '/hang':
+            # Held until the benchmark ends, the checker has to give up on its own
+            server.stopping.wait()
+            self.close_connection = True
+            return
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        status = 500 if self.path == '/error' else 200
+        body = b'ok\n' if status == 200 else b'error\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubTargets:
+    """Local targets for the checker to probe
+
+    HTTP hosts get their behavior from the path. TCP hosts connect to a
+    listener that accepts, a closed port for errors, or a listener that
+    never accepts for hangs, which stops completing handshakes once its
+    backlog is full.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.http = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.http.daemon_threads = True
+        self.http.latency = latency
+        self.http.jitter = jitter
+        self.http.stopping = threading.Event()
+
+        self.tcp = socket.create_server(('127.0.0.1', 0), backlog=128)
+        self.tarpit = socket.create_server(('127.0.0.1', 0), backlog=0)
+        # Bound but not listening, so connections are refused
+        self.closed = socket.socket()
+        self.closed.bind(('127.0.0.1', 0))
+
+        self.ports = {
+            'http': self.http.server_address[1],
+            'tcp': self.tcp.getsockname()[1],
+            'tcp_hang': self.tarpit.getsockname()[1],
+            'tcp_error': self.closed.getsockname()[1]
+        }
+        self._threads = []
+
+    def start(self):
+        for target in (self.http.serve_forever, self._accept):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self.http.stopping.set()
+        self.http.shutdown()
+        self.http.server_close()
+        for sock in (self.tcp, self.tarpit, self.closed):
+            sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except OSError:
+                return
+            conn.close()
+
+
+def target_url(rng, ports, tcp, error_rate, hang_rate):
+    """Pick the behavior of one host and get its URL and probe type"""
+    roll = rng.random()
+    if tcp:
+        port = ports['tcp_hang'] if roll < hang_rate else ports['tcp_error'] if roll < hang_rate + error_rate else ports['tcp']
+        return f'127.0.0.1:{port}', 'tcp-connect'
+    path = '/hang' if roll < hang_rate else '/error' if roll < hang_rate + error_rate else '/ok'
+    return f"http://127.0.0.1:{ports['http']}{path}", 'http'
+
+
+def generate_inventory(db, size, args, ports):
+    """Fill an empty database with `size` hosts spread over categories and locations"""
+    rng = random.Random(args.seed)
+    locations = [f'Site {n:03d}' for n in range(1, args.locations + 1)]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with db.connection() as conn:
+        conn.executemany('INSERT INTO categories (name, description) VALUES (?, ?)',
+                         [(f'Category {n:03d}', f'Synthetic category {n}') for n in range(1, args.categories + 1)])
+        category_ids = [row['id'] for row in conn.execute('SELECT id FROM categories')]
+
+        rows = []
+        for n in range(size):
+            url, probe_type = target_url(rng, ports, rng.random() < args.tcp_share, args.error_rate, args.hang_rate)
+            # A few hosts are left uncategorized, like in real inventories
+            category_id = rng.choice(category_ids) if rng.random() >= 0.05 else None
+            rows.append((f'host-{n:05d}', url, rng.choice(locations), f'Synthetic host {n}',
+                         rng.choice(('online', 'offline', 'unknown')), now,
+                         f'fa-{rng.choice(("server", "database", "network-wired", "tv", "print"))}',
+                         category_id, probe_type))
+
+        conn.executemany('''
+            INSERT INTO hosts (name, url, location, notes, status, last_checked, icon, category_id, probe_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    return category_ids
+
+
+def time_requests(client, path, repeat):
+    """Request a page `repeat` times after one cold request, returns timings in ms"""
+    timings = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {path} returned {response.status_code}')
+
+    warm = sorted(timings[1:])
+    return {
+        'path': path,
+        'cold_ms': round(timings[0], 3),
+        'min_ms': round(warm[0], 3),
+        'median_ms': round(warm[len(warm) // 2], 3),
+        'p95_ms': round(warm[min(len(warm) - 1, int(len(warm) * 0.95))], 3),
+        'max_ms': round(warm[-1], 3),
+        'bytes': len(response.data)
+    }
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far (Linux reports kB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_size(size, args):
+    """Benchmark one inventory size in this process and return its results"""
+    import yaml
+    import dashboard
+
+    workdir = args.workdir
+    config_file = os.path.join(workdir, 'config.yaml')
+    config = {
+        'app': {'health_check_timeout': args.timeout},
+        'checker': {'workers': args.workers, 'host_deadline': args.timeout * 2, 'sweep_deadline': 0},
+        'database': {'file': os.path.join(workdir, 'dashboard.db')}
+    }
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    if not dashboard.load_config(config_file):
+        sys.exit(1)
+    dashboard.init_paths()
+    dashboard.db.init_database()
+    dashboard.init_assets()
+    dashboard.init_checker()
+    ports = json.loads(args.ports)
+
+    start = time.perf_counter()
+    category_ids = generate_inventory(dashboard.db, size, args, ports)
+    generate_ms = (time.perf_counter() - start) * 1000
+
+    client = dashboard.app.test_client()
+    result = {
+        'hosts': size,
+        'categories': len(category_ids),
+        'locations': args.locations,
+        'generate_ms': round(generate_ms, 3),
+        'database_bytes': sum(os.path.getsize(path) for path in (dashboard.DATABASE_FILE, dashboard.DATABASE_FILE + '-wal')
+                              if os.path.exists(path)),
+        'index': time_requests(client, '/', args.repeat),
+        'category_page': time_requests(client, f'/category/{category_ids[0]}/hosts', args.repeat),
+        'locations_endpoint': time_requests(client, '/locations', args.repeat),
+        'peak_rss_kb_pages': peak_rss_kb(),
+        'sweep': None
+    }
+
+    if size <= args.sweep_max_hosts:
+        start = time.perf_counter()
+        response = client.get('/check_all_hosts?ajax=1')
+        wall_ms = (time.perf_counter() - start) * 1000
+        summary = response.get_json()
+        result['sweep'] = {
+            'wall_ms': round(wall_ms, 3),
+            'checked': summary['checked'],
+            'online': summary['online'],
+            'offline': summary['offline'],
+            'hosts_per_second': round(summary['checked'] / (wall_ms / 1000), 1)
+        }
+
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+def git_commit():
+    """Get the commit being benchmarked, if this is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard with synthetic inventories')
+    parser.add_argument('--sizes', default='100,1000,10000,50000', help='Comma separated inventory sizes')
+    parser.add_argument('--categories', type=int, default=50, help='Number of categories')
+    parser.add_argument('--locations', type=int, default=200, help='Number of distinct locations')
+    parser.add_argument('--tcp-share', type=float, default=0.2, help='Share of hosts probed with a TCP connect')
+    parser.add_argument('--latency', type=float, default=20, help='Stub HTTP response latency (ms)')
+    parser.add_argument('--jitter', type=float, default=10, help='Random extra latency up to this (ms)')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='Share of hosts that fail')
+    parser.add_argument('--hang-rate', type=float, default=0.01, help='Share of hosts that never answer')
+    parser.add_argument('--timeout', type=float, default=1, help='Health check timeout (seconds)')
+    parser.add_argument('--workers', type=int, default=16, help='Checker workers')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed requests per page')
+    parser.add_argument('--sweep-max-hosts', type=int, default=10000,
+                        help='Skip the Check All sweep for larger inventories')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the inventory')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the dashboard')
+    # Used internally to run one size in a child process
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ports', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        try:
+            result = run_size(args.run_one, args)
+        finally:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    targets = StubTargets(args.latency / 1000, args.jitter / 1000).start()
+    results = []
+
+    try:
+        for size in sizes:
+            print(f'Benchmarking {size} hosts...', file=sys.stderr)
+            with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+                command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+                    '--run-one', str(size), '--ports', json.dumps(targets.ports),
+                    '--result-file', result_file.name, '--workdir', tempfile.mkdtemp(prefix='dashboard-bench-')]
+                output = None if args.verbose else subprocess.DEVNULL
+                subprocess.run(command, stdout=output, stderr=output, check=True)
+                result = json.load(result_file)
+
+            results.append(result)
+            sweep = f"{result['sweep']['wall_ms']} ms" if result['sweep'] else 'skipped'
+            print(f"  index {result['index']['median_ms']} ms, "
+                  f"locations {result['locations_endpoint']['median_ms']} ms, "
+                  f"sweep {sweep}, "
+                  f"peak RSS {result['peak_rss_kb'] // 1024} MB", file=sys.stderr)
+    finally:
+        targets.stop()
+
+    report = {
+        'format': RESULTS_FORMAT,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'verbose', 'run_one', 'ports', 'result_file', 'workdir')},
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,26 @@
 #!/usr/bin/env python3
 """
-Migration script to import existing JSON data into SQLite database
-Usage: python3 migrate_json_to_sqlite.py <database_dir> <json_hosts_file> <json_categories_file>
+Migration script to import existing JSON, NDJSON or CSV data into SQLite database
+Usage: python3 migrate_json_to_sqlite.py <database_dir> <hosts_file> [<categories_file>] [--upsert]
+
+Input files are read as a stream and hosts are inserted in chunked
+transactions, so large inventories import quickly in constant memory.
 """
 
 import argparse
+import csv
+import itertools
 import json
-import sqlite3
 import os
+import time
 from datetime import datetime
 import sys
 
+# The dashboard modules live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DashboardDatabase
+
 def convert_datetime_format(datetime_str):
     """Convert datetime from various formats to SQLite DATETIME format (YYYY-MM-DD HH:MM:SS)"""
     if not datetime_str:
@@ -48,133 +58,309 @@ def convert_datetime_format(datetime_str):
         print(f"Warning: Error converting datetime '{datetime_str}': {e}, setting to None")
         return None
 
-def load_json(filename):
-    """Load JSON data from file"""
+
+class JSONStream:
+    """Reads the members of a top-level JSON object or array one at a time,
+    so a large file is never held in memory as a whole"""
+    
+    def __init__(self, f, read_size=65536):
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+    
+    def _fill(self):
+        chunk = self.f.read(self.read_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+    
+    def _peek(self):
+        """Skip whitespace and get the next character, '' at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+    
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char or 'end of file'!r}")
+        self.pos += 1
+        return char
+    
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value ending with the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+    
+    def members(self):
+        """Yield (key, value) for an object, or (index, value) for an array"""
+        opening = self._expect('{[')
+        closing = '}' if opening == '{' else ']'
+        if self._peek() == closing:
+            self.pos += 1
+            return
+        
+        index = 0
+        while True:
+            if opening == '{':
+                key = self._value()
+                self._expect(':')
+            else:
+                key = index
+            yield key, self._value()
+            index += 1
+            if self._expect(',' + closing) == closing:
+                return
+
+def detect_format(filename, requested='auto'):
+    """Get the format of an input file from --format or its extension"""
+    if requested != 'auto':
+        return requested
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    if extension == '.csv':
+        return 'csv'
+    return 'json'
+
+def iter_records(filename, file_format):
+    """Yield (old_id, record) for every record of an input file
+    
+    JSON files hold an object keyed by ID or an array, NDJSON files one
+    object per line and CSV files one record per row with a header. Records
+    outside a keyed JSON object take their ID from an "id" field, if any.
+    """
+    if file_format == 'csv':
+        with open(filename, 'r', newline='', encoding='utf-8-sig') as f:
+            for record in csv.DictReader(f):
+                # Empty cells are missing values
+                record = {key: value for key, value in record.items() if key and value != ''}
+                yield record.get('id'), record
+    elif file_format == 'ndjson':
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"line {line_number}: {e}")
+                yield record.get('id'), record
+    else:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for key, record in JSONStream(f).members():
+                yield (key if isinstance(key, str) else record.get('id')), record
+
+def parse_id(value):
+    """Get an integer ID from a JSON or CSV value, None when there is none"""
     try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"Warning: {filename} not found, skipping...")
-        return {}
-    except json.JSONDecodeError as e:
-        print(f"Error parsing {filename}: {e}")
-        return {}
-
-def init_database(db_file):
-    """Initialize the SQLite database with required tables"""
-    conn = sqlite3.connect(db_file)
-    
-    # Create categories table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT
-        )
-    ''')
-    
-    # Create hosts table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS hosts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            url TEXT NOT NULL,
-            location TEXT,
-            notes TEXT,
-            status TEXT DEFAULT 'unknown',
-            last_checked DATETIME,
-            icon TEXT,
-            category_id INTEGER,
-            FOREIGN KEY (category_id) REFERENCES categories (id)
-        )
-    ''')
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+class Progress:
+    """Prints how many records have been imported and how fast"""
+    
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.start = time.monotonic()
+    
+    def rate(self):
+        return self.count / max(time.monotonic() - self.start, 1e-6)
     
+    def add(self, count):
+        self.count += count
+        print(f"  {self.count} {self.label} imported, {self.rate():.0f}/s")
+    
+    def done(self):
+        print(f"Imported {self.count} {self.label} in {time.monotonic() - self.start:.1f}s ({self.rate():.0f}/s)")
+
+def defer_indexes(conn, keep_search=False):
+    """Drop the indexes on hosts and the search index before a bulk load
+    
+    Returns the statements that recreate the indexes. The search index and its
+    triggers are recreated and filled by DashboardDatabase.init_database().
+    With keep_search they stay, for imports into a database a running
+    dashboard may be searching meanwhile.
+    """
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'hosts' AND sql IS NOT NULL")]
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'hosts' AND sql IS NOT NULL")]
+    triggers = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%\\_fts\\_%' ESCAPE '\\'")]
+    
+    for name in names:
+        conn.execute(f'DROP INDEX "{name}"')
+    if not keep_search:
+        for name in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        conn.execute('DROP TABLE IF EXISTS hosts_fts')
     conn.commit()
-    conn.close()
-    print("Database initialized successfully")
+    return indexes
 
-def migrate_categories(db_file, categories_data):
-    """Migrate categories from JSON to SQLite"""
-    if not categories_data:
-        print("No categories to migrate")
-        return {}
+def next_version(conn):
+    """Bump the data version, so clients syncing deltas pick up the imported rows"""
+    conn.execute('UPDATE sync_state SET version = version + 1 WHERE id = 1')
+    return conn.execute('SELECT version FROM sync_state WHERE id = 1').fetchone()[0]
+
+def migrate_categories(conn, filename, file_format, upsert=False):
+    """Import categories, returns the mappings of old IDs and of names to new IDs
     
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    With upsert, categories are matched to existing ones by name.
+    """
+    names = {}
+    if upsert:
+        # The first category of a name wins when names repeat
+        for category_id, name in conn.execute('SELECT id, name FROM categories ORDER BY id DESC'):
+            names[name] = category_id
     
-    # Mapping from old ID to new ID
     id_mapping = {}
+    if not filename or not os.path.exists(filename):
+        print("No categories to migrate")
+        return id_mapping, names
     
-    # Sort by original ID to maintain order
-    sorted_categories = sorted(categories_data.items(), key=lambda x: int(x[0]))
-    
-    for old_id, category in sorted_categories:
-        cursor.execute('''
-            INSERT INTO categories (name, description)
-            VALUES (?, ?)
-        ''', (
-            category.get('name', ''),
-            category.get('description', '')
-        ))
-        
-        new_id = cursor.lastrowid
-        id_mapping[int(old_id)] = new_id
-        print(f"Migrated category: {category.get('name')} (old ID: {old_id}, new ID: {new_id})")
+    progress = Progress('categories')
+    version = next_version(conn)
+    for old_id, category in iter_records(filename, file_format):
+        name = category.get('name', '')
+        description = category.get('description', '')
+        if name in names:
+            conn.execute('UPDATE categories SET description = ?, version = ? WHERE id = ?',
+                         (description, version, names[name]))
+        else:
+            cursor = conn.execute('INSERT INTO categories (name, description, version) VALUES (?, ?, ?)',
+                                  (name, description, version))
+            names[name] = cursor.lastrowid
+        if parse_id(old_id) is not None:
+            id_mapping[parse_id(old_id)] = names[name]
+        progress.count += 1
     
     conn.commit()
-    conn.close()
+    progress.done()
+    return id_mapping, names
+
+def host_values(host, category_id_mapping, category_names, conn, version):
+    """Get the column values of an imported host, None for missing fields
     
-    print(f"Successfully migrated {len(categories_data)} categories")
-    return id_mapping
+    Hosts name their category by its old ID, or by name in a "category" field,
+    in which case missing categories are created.
+    """
+    category_id = category_id_mapping.get(parse_id(host.get('category_id')))
+    category_name = host.get('category')
+    if category_id is None and category_name:
+        if category_name not in category_names:
+            cursor = conn.execute('INSERT INTO categories (name, description, version) VALUES (?, ?, ?)',
+                                  (category_name, '', version))
+            category_names[category_name] = cursor.lastrowid
+        category_id = category_names[category_name]
+    
+    return {
+        'name': host.get('name', ''),
+        'url': host.get('url', ''),
+        'location': host.get('location'),
+        'notes': host.get('notes'),
+        'status': host.get('status'),
+        'last_checked': convert_datetime_format(host.get('last_checked')),
+        # Exports write hosts without an icon as ''
+        'icon': host.get('icon') or None,
+        'category_id': category_id,
+        'probe_type': host.get('probe_type'),
+        'check_interval': parse_id(host.get('check_interval')),
+        'version': version
+    }
 
-def migrate_hosts(db_file, hosts_data, category_id_mapping):
-    """Migrate hosts from JSON to SQLite"""
-    if not hosts_data:
-        print("No hosts to migrate")
-        return
+def migrate_hosts(conn, filename, file_format, category_id_mapping, category_names, upsert=False, chunk_size=5000):
+    """Import hosts with executemany, committing every chunk_size hosts
     
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    With upsert, hosts are matched to existing ones by name and updated.
+    Fields missing from the input keep their current values.
+    """
+    existing = {}
+    if upsert:
+        for host_id, name in conn.execute('SELECT id, name FROM hosts ORDER BY id DESC'):
+            existing[name] = host_id
     
-    # Sort by original ID to maintain order
-    sorted_hosts = sorted(hosts_data.items(), key=lambda x: int(x[0]))
+    progress = Progress('hosts')
+    skipped = 0
+    records = iter_records(filename, file_format)
     
-    migrated_count = 0
-    for old_id, host in sorted_hosts:
-        # Map old category ID to new category ID
-        category_id = None
-        if host.get('category_id') and int(host['category_id']) in category_id_mapping:
-            category_id = category_id_mapping[int(host['category_id'])]
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
         
-        cursor.execute('''
-            INSERT INTO hosts (name, url, location, notes, status, last_checked, icon, category_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            host.get('name', ''),
-            host.get('url', ''),
-            host.get('location', ''),
-            host.get('notes', ''),
-            host.get('status', 'unknown'),
-            convert_datetime_format(host.get('last_checked')),
-            host.get('icon'),
-            category_id
-        ))
+        version = next_version(conn)
+        inserts = []
+        updates = []
+        for old_id, host in chunk:
+            if not host.get('url'):
+                skipped += 1
+                continue
+            values = host_values(host, category_id_mapping, category_names, conn, version)
+            host_id = existing.get(values['name'])
+            if host_id is None:
+                inserts.append(values)
+            else:
+                updates.append(dict(values, id=host_id))
         
-        new_id = cursor.lastrowid
-        print(f"Migrated host: {host.get('name')} (old ID: {old_id}, new ID: {new_id})")
-        migrated_count += 1
+        conn.executemany('''
+            INSERT INTO hosts (name, url, location, notes, status, last_checked, icon,
+                               category_id, probe_type, check_interval, version)
+            VALUES (:name, :url, COALESCE(:location, ''), COALESCE(:notes, ''), COALESCE(:status, 'unknown'),
+                    :last_checked, :icon, :category_id, COALESCE(:probe_type, 'http'), :check_interval, :version)
+        ''', inserts)
+        conn.executemany('''
+            UPDATE hosts SET
+                url = :url,
+                location = COALESCE(:location, location),
+                notes = COALESCE(:notes, notes),
+                status = COALESCE(:status, status),
+                last_checked = COALESCE(:last_checked, last_checked),
+                icon = COALESCE(:icon, icon),
+                category_id = COALESCE(:category_id, category_id),
+                probe_type = COALESCE(:probe_type, probe_type),
+                check_interval = COALESCE(:check_interval, check_interval),
+                version = :version,
+                -- The resolved URL only stays valid while the URL is unchanged
+                resolved_url = CASE WHEN url = :url THEN resolved_url END,
+                resolved_scheme = CASE WHEN url = :url THEN resolved_scheme END
+            WHERE id = :id
+        ''', updates)
+        conn.commit()
+        progress.add(len(inserts) + len(updates))
     
-    conn.commit()
-    conn.close()
-    
-    print(f"Successfully migrated {migrated_count} hosts")
+    progress.done()
+    if skipped:
+        print(f"Warning: Skipped {skipped} hosts without a URL")
 
 def main():
-    parser = argparse.ArgumentParser(description='Migrate JSON data to SQLite database')
+    parser = argparse.ArgumentParser(description='Import JSON, NDJSON or CSV data into the SQLite database')
     parser.add_argument('database_dir', help='Directory where SQLite database will be created')
-    parser.add_argument('json_hosts_file', help='Path to JSON hosts file')
-    parser.add_argument('json_categories_file', help='Path to JSON categories file')
+    parser.add_argument('json_hosts_file', help='Path to hosts file (JSON, NDJSON or CSV)')
+    parser.add_argument('json_categories_file', nargs='?', help='Path to categories file (JSON, NDJSON or CSV)')
     parser.add_argument('--force', action='store_true', help='Overwrite existing database')
+    parser.add_argument('--upsert', action='store_true',
+                        help='Import into an existing database, updating hosts and categories with the same name')
+    parser.add_argument('--format', choices=['auto', 'json', 'ndjson', 'csv'], default='auto',
+                        help='Input format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Hosts inserted per transaction')
     
     args = parser.parse_args()
     
@@ -183,7 +369,7 @@ def main():
         print(f"Error: Hosts file {args.json_hosts_file} does not exist")
         sys.exit(1)
     
-    if not os.path.exists(args.json_categories_file):
+    if args.json_categories_file and not os.path.exists(args.json_categories_file):
         print(f"Warning: Categories file {args.json_categories_file} does not exist, will create empty categories")
     
     # Create database directory if it doesn't exist
@@ -195,37 +381,59 @@ def main():
     db_file = os.path.join(args.database_dir, 'dashboard.db')
     
     # Check if database already exists
-    if os.path.exists(db_file) and not args.force:
-        response = input(f"Database {db_file} already exists. Overwrite? (y/N): ")
-        if response.lower() not in ['y', 'yes']:
-            print("Migration cancelled")
-            sys.exit(0)
-        os.remove(db_file)
+    if os.path.exists(db_file) and not args.upsert:
+        if not args.force:
+            response = input(f"Database {db_file} already exists. Overwrite? (y/N): ")
+            if response.lower() not in ['y', 'yes']:
+                print("Migration cancelled")
+                sys.exit(0)
+        for path in (db_file, db_file + '-wal', db_file + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
     
     print("Starting migration...")
     print(f"Database: {db_file}")
-    print(f"Hosts JSON: {args.json_hosts_file}")
-    print(f"Categories JSON: {args.json_categories_file}")
+    print(f"Hosts file: {args.json_hosts_file}")
+    print(f"Categories file: {args.json_categories_file}")
     print("-" * 50)
     
-    # Initialize database
-    init_database(db_file)
-    
-    # Load JSON data
-    print("Loading JSON data...")
-    categories_data = load_json(args.json_categories_file)
-    hosts_data = load_json(args.json_hosts_file)
+    # Create or upgrade the schema the dashboard uses
+    db = DashboardDatabase(db_file)
+    db.init_database()
     
-    print(f"Found {len(categories_data)} categories and {len(hosts_data)} hosts in JSON files")
-    
-    # Migrate categories first (to get ID mapping)
-    print("\nMigrating categories...")
-    category_id_mapping = migrate_categories(db_file, categories_data)
-    
-    # Migrate hosts
-    print("\nMigrating hosts...")
-    migrate_hosts(db_file, hosts_data, category_id_mapping)
+    failed = False
+    with db.connection() as conn:
+        # Upserts go into a database the dashboard may be serving from
+        indexes = defer_indexes(conn, keep_search=args.upsert)
+        try:
+            print("\nMigrating categories...")
+            category_id_mapping, category_names = migrate_categories(
+                conn, args.json_categories_file, detect_format(args.json_categories_file or '', args.format), args.upsert)
+            
+            print("\nMigrating hosts...")
+            migrate_hosts(conn, args.json_hosts_file, detect_format(args.json_hosts_file, args.format),
+                          category_id_mapping, category_names, args.upsert, args.chunk_size)
+        except (ValueError, KeyError, AttributeError) as e:
+            # Chunks committed so far stay, the indexes are restored below
+            conn.rollback()
+            print(f"Error parsing input: {e}")
+            failed = True
+        finally:
+            print("\nCreating indexes...")
+            start = time.monotonic()
+            for sql in indexes:
+                conn.execute(sql)
+            conn.commit()
     
+    # Recreates the search index from the imported rows
+    db.init_database()
+    print(f"Indexes created in {time.monotonic() - start:.1f}s")
+    db.close()
+
+    if failed:
+        print("Migration stopped, hosts imported before the error were kept")
+        sys.exit(1)
+
     print("\n" + "=" * 50)
     print("Migration completed successfully!")
     print(f"SQLite database created at: {db_file}")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Re-process the icons already in the icons folder with the upload pipeline:
+resize and re-encode raster icons with a 2x variant, sanitize and minify SVGs,
+and move them into the content-addressed store shared by hosts
+Usage: python3 process_icons.py <config_file> [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+
+# The dashboard modules live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dashboard
+from icons import IconError, load_pillow, HIDPI_SUFFIX, process_icon, store_icon, remove_icon, hidpi_name
+
+
+def is_processed(path, size, image_format):
+    """Check whether a raster icon already has the target format and size"""
+    Image = load_pillow()
+    if Image is None or not path.endswith('.' + image_format):
+        return False
+    try:
+        with Image.open(path) as image:
+            return max(image.size) <= size
+    except OSError:
+        return False
+
+
+def read_variants(upload_folder, fname):
+    """Read an icon file and its 2x variant, if any, as stored"""
+    variants = {}
+    for suffix, name in (('', fname), (HIDPI_SUFFIX, hidpi_name(fname))):
+        path = os.path.join(upload_folder, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                variants[suffix] = f.read()
+    return variants
+
+
+def process_host_icon(host, upload_folder, size, image_format, dry_run=False, force=False):
+    """Re-process the icon of one host and move it into the shared store
+
+    Returns the new icon file name with its extension and variants,
+    or None if the icon is unchanged.
+    """
+    fname = host['icon']
+    stored = read_variants(upload_folder, fname)
+    if '' not in stored:
+        print(f"Warning: Icon {fname} of host {host['id']} not found, skipping...")
+        return None
+
+    # Re-encoding a processed icon again would only lose quality
+    if not force and is_processed(os.path.join(upload_folder, fname), size, image_format):
+        extension, variants = os.path.splitext(fname)[1], stored
+    else:
+        # An earlier run kept the 2x variant, which is the better source
+        try:
+            extension, variants = process_icon(stored.get(HIDPI_SUFFIX, stored['']),
+                                               os.path.splitext(fname)[1], size, image_format)
+        except IconError as e:
+            print(f"Warning: Icon {fname} of host {host['id']} could not be processed: {e}")
+            return None
+
+    if dry_run:
+        before = sum(len(variant) for variant in stored.values())
+        after = sum(len(variant) for variant in variants.values())
+        print(f"  {fname}: {before} -> {after} bytes, {len(variants)} variant(s)")
+        return None
+
+    icon = store_icon(upload_folder, extension, variants)
+    if icon == fname:
+        return None
+    print(f"  {fname} -> {icon}")
+    return icon, extension, variants
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-process existing host icons')
+    parser.add_argument('config_file', help='YAML configuration file path')
+    parser.add_argument('--dry-run', action='store_true', help='Only show what would be done')
+    parser.add_argument('--force', action='store_true', help='Also re-process icons that were processed before')
+
+    args = parser.parse_args()
+
+    if not dashboard.load_config(args.config_file):
+        sys.exit(1)
+
+    dashboard.init_paths()
+    dashboard.db.init_database()
+
+    size = dashboard.CONFIG['app']['icon_size']
+    image_format = dashboard.CONFIG['app']['icon_format']
+    processed = 0
+
+    for host in dashboard.db.get_all_hosts():
+        if not host.get('icon') or host['icon'].startswith('fa-'):
+            continue
+
+        stored = process_host_icon(host, dashboard.UPLOAD_FOLDER, size, image_format, args.dry_run, args.force)
+        if stored:
+            icon, extension, variants = stored
+            dashboard.db.set_host_icon(host['id'], icon)
+            # The dashboard may have deleted the file before the reference was counted
+            store_icon(dashboard.UPLOAD_FOLDER, extension, variants)
+            processed += 1
+
+    if args.dry_run:
+        print("Dry run, no icons were changed")
+        return
+
+    # The files replaced above are no longer used by any host
+    dashboard.db.take_unused_icons(lambda icon: remove_icon(dashboard.UPLOAD_FOLDER, icon))
+    print(f"Processed {processed} icon(s)")
+
+
+if __name__ == '__main__':
+    main()